@@ -3,12 +3,14 @@ from __future__ import annotations
 from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 from math import sqrt
+from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from analytics.statistical.time_series import video_bucket_start
-from database.models import CleanDanmu, RawDanmu
+from data_pipeline.loader.snapshot import snapshot_rows
+from database.models import CleanDanmu
 
 
 def detect_bursty_tokens(
@@ -21,23 +23,25 @@ def detect_bursty_tokens(
     burst_top_k: int = 30,
     z_threshold: float = 3.0,
     min_count: int = 10,
+    snapshot: Any | None = None,
 ) -> dict:
     stmt = (
-        select(RawDanmu.video_ts, CleanDanmu.tokens_json)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
+        select(CleanDanmu.video_ts, CleanDanmu.tokens_json)
         .where(
             CleanDanmu.platform == platform,
             CleanDanmu.video_id == video_id,
             CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
         )
-        .order_by(RawDanmu.video_ts.asc())
+        .order_by(CleanDanmu.video_ts.asc())
     )
 
     bucket_tokens: dict[datetime, Counter[str]] = defaultdict(Counter)
     total_counter: Counter[str] = Counter()
-    for video_ts, tokens in db.execute(stmt).all():
+    if snapshot is not None:
+        rows = snapshot_rows(snapshot, "video_ts", "tokens", sort_by="video_ts")
+    else:
+        rows = db.execute(stmt).all()
+    for video_ts, tokens in rows:
         if video_ts is None or not tokens:
             continue
         b = video_bucket_start(float(video_ts), bucket_sec)
@@ -47,7 +51,7 @@ def detect_bursty_tokens(
             bucket_tokens[b][t] += 1
             total_counter[t] += 1
 
-    candidates = [t for t, _ in total_counter.most_common(token_top_k)]
+    candidates = [t for t, _ in sorted(total_counter.items(), key=lambda item: (-item[1], item[0]))[:token_top_k]]
     buckets = sorted(bucket_tokens.keys())
     if not buckets or not candidates:
         return {"items": []}
@@ -75,7 +79,7 @@ def detect_bursty_tokens(
             }
         )
 
-    items.sort(key=lambda x: x["z_score"], reverse=True)
+    items.sort(key=lambda x: (-x["z_score"], x["token"]))
     return {"items": items[:burst_top_k]}
 
 
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 from collections import Counter
+from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from data_pipeline.loader.snapshot import token_counts
 from database.models import CleanDanmu
 
 
@@ -34,21 +36,31 @@ _STOP_TOKENS = {
 }
 
 
-def top_keywords(db: Session, platform: str, video_id: str, pipeline_run_id: int, top_k: int = 50) -> list[dict]:
+def top_keywords(
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, top_k: int = 50, snapshot: Any | None = None
+) -> list[dict]:
     stmt = select(CleanDanmu.tokens_json).where(
         CleanDanmu.platform == platform,
         CleanDanmu.video_id == video_id,
         CleanDanmu.pipeline_run_id == pipeline_run_id,
     )
     counter: Counter[str] = Counter()
-    for (tokens,) in db.execute(stmt).all():
-        if not tokens:
-            continue
-        for t in tokens:
-            if not t or t in _STOP_TOKENS:
+    if snapshot is not None:
+        for t, count in token_counts(snapshot):
+            if _keep_token(t):
+                counter[t] += count
+    else:
+        for (tokens,) in db.execute(stmt).all():
+            if not tokens:
                 continue
-            if len(t) == 1 and not t.isalnum():
-                continue
-            counter[t] += 1
-    return [{"token": k, "count": int(v)} for k, v in counter.most_common(top_k)]
+            for t in tokens:
+                if _keep_token(t):
+                    counter[t] += 1
+    ranked = sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+    return [{"token": k, "count": int(v)} for k, v in ranked]
+
 
+def _keep_token(t: str | None) -> bool:
+    if not t or t in _STOP_TOKENS:
+        return False
+    return len(t) > 1 or t.isalnum()
@@ -3,7 +3,7 @@ from __future__ import annotations
 import logging
 from datetime import datetime, timezone
 
-from sqlalchemy import delete, select
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
 
 from analytics.nlp.burst import detect_bursty_tokens
@@ -13,7 +13,10 @@ from analytics.statistical.peak import detect_peaks
 from analytics.statistical.cognitive import cognitive_metrics_by_bucket
 from analytics.statistical.time_series import count_by_time_bucket, sentiment_ratio_by_bucket, user_activity_summary
 from analytics.statistical.user_profile import danmu_type_distribution, user_segmentation_summary
-from database.models import MetricsSummary, MetricsTimeSeries, PipelineRun
+from config.settings import settings
+from data_pipeline.loader.snapshot import load_snapshot
+from database.models import CleanDanmu, MetricsSummary, MetricsTimeSeries, PipelineRun
+from monitoring import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -24,12 +27,31 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
     if run is None:
         raise ValueError(f"pipeline_run 不存在: {pipeline_run_id}")
 
+    snapshot = None
+    if settings.pipeline_snapshot_enabled:
+        clean_rows = db.execute(
+            select(func.count())
+            .select_from(CleanDanmu)
+            .where(CleanDanmu.platform == platform, CleanDanmu.video_id == video_id, CleanDanmu.pipeline_run_id == pipeline_run_id)
+        ).scalar_one()
+        snapshot = load_snapshot(pipeline_run_id, platform, video_id, clean_rows)
+    if snapshot is not None:
+        logger.info("analysis reads snapshot pipeline_run_id=%s rows=%s", pipeline_run_id, snapshot.num_rows)
+
     db.execute(delete(MetricsTimeSeries).where(MetricsTimeSeries.pipeline_run_id == pipeline_run_id))
     db.execute(delete(MetricsSummary).where(MetricsSummary.pipeline_run_id == pipeline_run_id))
     db.commit()
 
     for bucket_sec in (10, 60):
-        count_series = count_by_time_bucket(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=bucket_sec)
+        with metrics.analyzer_seconds.time(analyzer="count_by_time_bucket"):
+            count_series = count_by_time_bucket(
+                db,
+                platform=platform,
+                video_id=video_id,
+                pipeline_run_id=pipeline_run_id,
+                bucket_sec=bucket_sec,
+                snapshot=snapshot,
+            )
         for bucket_start, count in count_series:
             db.add(
                 MetricsTimeSeries(
@@ -43,9 +65,16 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
                 )
             )
         for label, name in (("positive", "sentiment_positive_ratio"), ("negative", "sentiment_negative_ratio")):
-            ratio_series = sentiment_ratio_by_bucket(
-                db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=bucket_sec, label=label
-            )
+            with metrics.analyzer_seconds.time(analyzer="sentiment_ratio_by_bucket"):
+                ratio_series = sentiment_ratio_by_bucket(
+                    db,
+                    platform=platform,
+                    video_id=video_id,
+                    pipeline_run_id=pipeline_run_id,
+                    bucket_sec=bucket_sec,
+                    label=label,
+                    snapshot=snapshot,
+                )
             for bucket_start, ratio in ratio_series:
                 db.add(
                     MetricsTimeSeries(
@@ -60,8 +89,12 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
                 )
         db.commit()
 
-    count_10s = count_by_time_bucket(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10)
-    peaks = detect_peaks(count_10s)
+    with metrics.analyzer_seconds.time(analyzer="count_by_time_bucket"):
+        count_10s = count_by_time_bucket(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10, snapshot=snapshot
+        )
+    with metrics.analyzer_seconds.time(analyzer="detect_peaks"):
+        peaks = detect_peaks(count_10s)
     peak_segments = [
         {"start_sec": int(p.start.timestamp()), "end_sec": int(p.end.timestamp()), "peak_count": int(p.peak_value)} for p in peaks
     ]
@@ -75,7 +108,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    keywords = top_keywords(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, top_k=50)
+    with metrics.analyzer_seconds.time(analyzer="top_keywords"):
+        keywords = top_keywords(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, top_k=50, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -86,7 +122,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    user_summary = user_activity_summary(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id)
+    with metrics.analyzer_seconds.time(analyzer="user_activity_summary"):
+        user_summary = user_activity_summary(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -97,7 +136,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    cognitive = cognitive_metrics_by_bucket(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10)
+    with metrics.analyzer_seconds.time(analyzer="cognitive_metrics_by_bucket"):
+        cognitive = cognitive_metrics_by_bucket(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10, snapshot=snapshot
+        )
     for metric_name, series in cognitive.items():
         for bucket_start, v in series:
             db.add(
@@ -113,7 +155,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
             )
     db.commit()
 
-    mention_network = build_mention_network_summary(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id)
+    with metrics.analyzer_seconds.time(analyzer="build_mention_network_summary"):
+        mention_network = build_mention_network_summary(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -124,7 +169,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    bursts = detect_bursty_tokens(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10)
+    with metrics.analyzer_seconds.time(analyzer="detect_bursty_tokens"):
+        bursts = detect_bursty_tokens(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, bucket_sec=10, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -135,7 +183,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    segments = user_segmentation_summary(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id)
+    with metrics.analyzer_seconds.time(analyzer="user_segmentation_summary"):
+        segments = user_segmentation_summary(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -146,7 +197,10 @@ def run_analysis(db: Session, platform: str, video_id: str, pipeline_run_id: int
         )
     )
 
-    type_dist = danmu_type_distribution(db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id)
+    with metrics.analyzer_seconds.time(analyzer="danmu_type_distribution"):
+        type_dist = danmu_type_distribution(
+            db, platform=platform, video_id=video_id, pipeline_run_id=pipeline_run_id, snapshot=snapshot
+        )
     db.add(
         MetricsSummary(
             platform=platform,
@@ -2,26 +2,27 @@ from __future__ import annotations
 
 import re
 from collections import Counter, defaultdict
+from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from database.models import CleanDanmu, RawDanmu
+from data_pipeline.loader.snapshot import snapshot_rows
+from database.models import CleanDanmu
 
 
 _MENTION_RE = re.compile(r"@([0-9A-Za-z_\u4e00-\u9fff\-]{1,20})")
 
 
-def build_mention_network_summary(db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20) -> dict:
+def build_mention_network_summary(
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20, snapshot: Any | None = None
+) -> dict:
     stmt = (
-        select(RawDanmu.user_id_hash, CleanDanmu.content_norm)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
+        select(CleanDanmu.user_id_hash, CleanDanmu.content_norm)
         .where(
             CleanDanmu.platform == platform,
             CleanDanmu.video_id == video_id,
             CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
         )
     )
 
@@ -31,7 +32,8 @@ def build_mention_network_summary(db: Session, platform: str, video_id: str, pip
     unique_targets_by_sender: dict[str, set[str]] = defaultdict(set)
 
     messages = 0
-    for sender_hash, content in db.execute(stmt).all():
+    rows = snapshot_rows(snapshot, "user_id_hash", "content_norm") if snapshot is not None else db.execute(stmt).all()
+    for sender_hash, content in rows:
         messages += 1
         if not sender_hash or not content:
             continue
@@ -47,9 +49,9 @@ def build_mention_network_summary(db: Session, platform: str, video_id: str, pip
     edges = int(sum(edge_counter.values()))
     unique_senders = len(out_counter)
     unique_targets = len(in_counter)
-    top_senders = [{"user_id_hash": k, "out_mentions": int(v), "unique_targets": len(unique_targets_by_sender[k])} for k, v in out_counter.most_common(top_n)]
-    top_targets = [{"target": k, "in_mentions": int(v)} for k, v in in_counter.most_common(top_n)]
-    top_edges = [{"from_user_id_hash": a, "to_target": b, "count": int(c)} for (a, b), c in edge_counter.most_common(top_n)]
+    top_senders = [{"user_id_hash": k, "out_mentions": int(v), "unique_targets": len(unique_targets_by_sender[k])} for k, v in _most_common(out_counter, top_n)]
+    top_targets = [{"target": k, "in_mentions": int(v)} for k, v in _most_common(in_counter, top_n)]
+    top_edges = [{"from_user_id_hash": a, "to_target": b, "count": int(c)} for (a, b), c in _most_common(edge_counter, top_n)]
 
     return {
         "messages": messages,
@@ -60,3 +62,7 @@ def build_mention_network_summary(db: Session, platform: str, video_id: str, pip
         "top_targets": top_targets,
         "top_edges": top_edges,
     }
+
+
+def _most_common(counter: Counter[Any], n: int) -> list[tuple[Any, int]]:
+    return sorted(counter.items(), key=lambda item: (-item[1], item[0]))[:n]
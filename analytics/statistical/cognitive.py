@@ -3,34 +3,34 @@ from __future__ import annotations
 from collections import Counter, defaultdict
 from datetime import datetime
 from math import log
+from typing import Any
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from analytics.statistical.time_series import video_bucket_start
-from database.models import CleanDanmu, RawDanmu
+from data_pipeline.loader.snapshot import snapshot_rows
+from database.models import CleanDanmu
 
 
 def cognitive_metrics_by_bucket(
-    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int, snapshot: Any | None = None
 ) -> dict[str, list[tuple[datetime, float]]]:
     stmt = (
-        select(RawDanmu.video_ts, CleanDanmu.tokens_json)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
+        select(CleanDanmu.video_ts, CleanDanmu.tokens_json)
         .where(
             CleanDanmu.platform == platform,
             CleanDanmu.video_id == video_id,
             CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
         )
-        .order_by(RawDanmu.video_ts.asc())
+        .order_by(CleanDanmu.video_ts.asc())
     )
 
     token_counts_by_bucket: dict[datetime, Counter[str]] = defaultdict(Counter)
     total_tokens_by_bucket: Counter[datetime] = Counter()
     unique_tokens_by_bucket: dict[datetime, set[str]] = defaultdict(set)
-    for video_ts, tokens in db.execute(stmt).all():
+    rows = snapshot_rows(snapshot, "video_ts", "tokens") if snapshot is not None else db.execute(stmt).all()
+    for video_ts, tokens in rows:
         if video_ts is None:
             continue
         bucket_start = video_bucket_start(float(video_ts), bucket_sec)
@@ -62,7 +62,7 @@ def _shannon_entropy(counter: Counter[str]) -> float:
     if total <= 0:
         return 0.0
     h = 0.0
-    for c in counter.values():
+    for c in sorted(counter.values()):
         p = c / total
         if p > 0:
             h -= p * log(p)
@@ -2,11 +2,13 @@ from __future__ import annotations
 
 from collections import Counter
 from datetime import datetime, timezone
+from typing import Any
 
 from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
-from database.models import CleanDanmu, RawDanmu
+from data_pipeline.loader.snapshot import bucket_counts, pc, snapshot_rows
+from database.models import CleanDanmu
 
 
 def video_bucket_start(video_ts_sec: float, bucket_sec: int) -> datetime:
@@ -14,20 +16,20 @@ def video_bucket_start(video_ts_sec: float, bucket_sec: int) -> datetime:
     return datetime.fromtimestamp(bucket, tz=timezone.utc)
 
 
+def _bucket_datetime(bucket_start_sec: int) -> datetime:
+    return datetime.fromtimestamp(bucket_start_sec, tz=timezone.utc)
+
+
 def count_by_time_bucket(
-    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int, snapshot: Any | None = None
 ) -> list[tuple[datetime, int]]:
-    stmt = (
-        select(RawDanmu.video_ts)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
-        .where(
-            CleanDanmu.platform == platform,
-            CleanDanmu.video_id == video_id,
-            CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
-        )
+    stmt = select(CleanDanmu.video_ts).where(
+        CleanDanmu.platform == platform,
+        CleanDanmu.video_id == video_id,
+        CleanDanmu.pipeline_run_id == pipeline_run_id,
     )
+    if snapshot is not None:
+        return sorted((_bucket_datetime(b), c) for b, c in bucket_counts(snapshot, bucket_sec).items())
     counts: Counter[datetime] = Counter()
     for (video_ts,) in db.execute(stmt).all():
         if video_ts is None:
@@ -37,28 +39,27 @@ def count_by_time_bucket(
 
 
 def sentiment_ratio_by_bucket(
-    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int, label: str
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, bucket_sec: int, label: str, snapshot: Any | None = None
 ) -> list[tuple[datetime, float]]:
-    time_stmt = (
-        select(RawDanmu.video_ts, CleanDanmu.sentiment_label)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
-        .where(
-            CleanDanmu.platform == platform,
-            CleanDanmu.video_id == video_id,
-            CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
-        )
+    time_stmt = select(CleanDanmu.video_ts, CleanDanmu.sentiment_label).where(
+        CleanDanmu.platform == platform,
+        CleanDanmu.video_id == video_id,
+        CleanDanmu.pipeline_run_id == pipeline_run_id,
     )
     total: Counter[datetime] = Counter()
     matched: Counter[datetime] = Counter()
-    for video_ts, s_label in db.execute(time_stmt).all():
-        if video_ts is None:
-            continue
-        bucket_start = video_bucket_start(float(video_ts), bucket_sec)
-        total[bucket_start] += 1
-        if s_label == label:
-            matched[bucket_start] += 1
+    if snapshot is not None:
+        total.update({_bucket_datetime(b): c for b, c in bucket_counts(snapshot, bucket_sec).items()})
+        is_label = pc.equal(snapshot.column("sentiment_label"), label)
+        matched.update({_bucket_datetime(b): c for b, c in bucket_counts(snapshot, bucket_sec, is_label).items()})
+    else:
+        for video_ts, s_label in db.execute(time_stmt).all():
+            if video_ts is None:
+                continue
+            bucket_start = video_bucket_start(float(video_ts), bucket_sec)
+            total[bucket_start] += 1
+            if s_label == label:
+                matched[bucket_start] += 1
     series: list[tuple[datetime, float]] = []
     for bucket_start in sorted(total.keys()):
         denom = total[bucket_start]
@@ -66,25 +67,25 @@ def sentiment_ratio_by_bucket(
     return series
 
 
-def user_activity_summary(db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20) -> dict:
-    raw_ids_stmt = select(CleanDanmu.raw_id).where(
-        CleanDanmu.platform == platform,
-        CleanDanmu.video_id == video_id,
-        CleanDanmu.pipeline_run_id == pipeline_run_id,
-    )
-    subq = raw_ids_stmt.subquery()
+def user_activity_summary(
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20, snapshot: Any | None = None
+) -> dict:
     user_stmt = (
-        select(RawDanmu.user_id_hash, func.count(RawDanmu.id))
+        select(CleanDanmu.user_id_hash, func.count(CleanDanmu.id))
         .where(
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
-            RawDanmu.id.in_(select(subq.c.raw_id)),
-            RawDanmu.user_id_hash.is_not(None),
+            CleanDanmu.platform == platform,
+            CleanDanmu.video_id == video_id,
+            CleanDanmu.pipeline_run_id == pipeline_run_id,
+            CleanDanmu.user_id_hash.is_not(None),
         )
-        .group_by(RawDanmu.user_id_hash)
-        .order_by(func.count(RawDanmu.id).desc())
+        .group_by(CleanDanmu.user_id_hash)
+        .order_by(func.count(CleanDanmu.id).desc(), CleanDanmu.user_id_hash.asc())
     )
-    rows = list(db.execute(user_stmt).all())
+    if snapshot is not None:
+        counts = Counter(u for (u,) in snapshot_rows(snapshot, "user_id_hash") if u is not None)
+        rows = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    else:
+        rows = list(db.execute(user_stmt).all())
     unique_users = len(rows)
     top = [{"user_id_hash": u, "count": int(c)} for (u, c) in rows[:top_n]]
     total_msgs = int(sum(int(c) for (_, c) in rows))
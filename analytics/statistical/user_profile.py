@@ -2,14 +2,16 @@ from __future__ import annotations
 
 from collections import Counter, defaultdict
 from statistics import mean
+from typing import Any
 
 from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
-from database.models import CleanDanmu, RawDanmu
+from data_pipeline.loader.snapshot import snapshot_rows
+from database.models import CleanDanmu
 
 
-def danmu_type_distribution(db: Session, platform: str, video_id: str, pipeline_run_id: int) -> dict:
+def danmu_type_distribution(db: Session, platform: str, video_id: str, pipeline_run_id: int, snapshot: Any | None = None) -> dict:
     stmt = (
         select(CleanDanmu.danmu_type, func.count(CleanDanmu.id))
         .where(
@@ -20,30 +22,34 @@ def danmu_type_distribution(db: Session, platform: str, video_id: str, pipeline_
         .group_by(CleanDanmu.danmu_type)
         .order_by(func.count(CleanDanmu.id).desc())
     )
-    items = [{"type": t or "unknown", "count": int(c)} for t, c in db.execute(stmt).all()]
+    if snapshot is not None:
+        rows = Counter(t for (t,) in snapshot_rows(snapshot, "danmu_type")).items()
+    else:
+        rows = db.execute(stmt).all()
+    items = [{"type": t or "unknown", "count": int(c)} for t, c in sorted(rows, key=lambda item: (-item[1], item[0] or ""))]
     total = sum(i["count"] for i in items)
     return {"total": int(total), "items": items}
 
 
-def user_segmentation_summary(db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20) -> dict:
+def user_segmentation_summary(
+    db: Session, platform: str, video_id: str, pipeline_run_id: int, top_n: int = 20, snapshot: Any | None = None
+) -> dict:
     stmt = (
-        select(RawDanmu.user_id_hash, CleanDanmu.content_norm)
-        .join(CleanDanmu, CleanDanmu.raw_id == RawDanmu.id)
+        select(CleanDanmu.user_id_hash, CleanDanmu.content_norm)
         .where(
             CleanDanmu.platform == platform,
             CleanDanmu.video_id == video_id,
             CleanDanmu.pipeline_run_id == pipeline_run_id,
-            RawDanmu.platform == platform,
-            RawDanmu.video_id == video_id,
-            RawDanmu.user_id_hash.is_not(None),
+            CleanDanmu.user_id_hash.is_not(None),
         )
-        .order_by(RawDanmu.id.asc())
+        .order_by(CleanDanmu.raw_id.asc())
     )
 
     counts: Counter[str] = Counter()
     lengths: dict[str, list[int]] = defaultdict(list)
     content_uniqs: dict[str, set[str]] = defaultdict(set)
-    for user_hash, content in db.execute(stmt).all():
+    rows = snapshot_rows(snapshot, "user_id_hash", "content_norm") if snapshot is not None else db.execute(stmt).all()
+    for user_hash, content in rows:
         if not user_hash or not content:
             continue
         counts[user_hash] += 1
@@ -60,7 +66,8 @@ def user_segmentation_summary(db: Session, platform: str, video_id: str, pipelin
         segment_stats[user_hash] = {"count": int(c), "avg_len": float(avg_len), "unique_ratio": float(uniq_ratio), "segment": seg}
 
     segment_counts = {k: len(v) for k, v in segments.items()}
-    top_users = [{"user_id_hash": u, **segment_stats[u]} for u, _ in counts.most_common(top_n)]
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+    top_users = [{"user_id_hash": u, **segment_stats[u]} for u, _ in ranked]
     return {"segment_counts": segment_counts, "top_users": top_users}
 
 
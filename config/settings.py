@@ -9,9 +9,69 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
     database_url: str = "sqlite:///./data/app.db"
+    async_database_url: str | None = None
+    read_database_url: str | None = None
+    async_read_database_url: str | None = None
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    read_db_pool_size: int = 10
+    read_db_max_overflow: int = 20
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_cache_size_kib: int = 65536
+    sqlite_mmap_size_mb: int = 256
+    sqlite_temp_store: str = "MEMORY"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_auto_vacuum: str = "INCREMENTAL"
+    sqlite_maintenance_interval_sec: float = 600.0
+    shard_count: int = 0
+    shard_url_template: str = "sqlite:///./data/shards/danmu_{shard}.db"
+    raw_extra_format: str = "json"
+    pipeline_snapshot_enabled: bool = False
+    pipeline_snapshot_dir: Path = Path("./data/snapshots")
+    retention_keep_runs: int = 3
+    retention_keep_days: float = 0.0
+    retention_interval_sec: float = 3600.0
+    retention_batch_size: int = 500
+    retention_vacuum_pages: int = 1000
     data_dir: Path = Path("./data")
     cache_dir: Path = Path("./data/cache")
     log_level: str = "INFO"
+    metrics_enabled: bool = True
+    crawl_segment_concurrency: int = 4
+    crawl_worker_count: int = 3
+    crawl_lease_sec: float = 120.0
+    crawl_write_queue_size: int = 8
+    crawl_priority_aging_sec: float = 600.0
+    crawl_deadline_window_sec: float = 600.0
+    crawl_max_running_per_platform: int = 0
+    crawl_max_running_per_submitter: int = 2
+    scheduler_poll_interval_sec: float = 30.0
+    scheduler_signal_path: Path = Path("./data/.crawl_task_signal")
+    scheduler_signal_check_sec: float = 0.2
+    crawl_archive_enabled: bool = False
+    crawl_archive_dir: Path = Path("./data/archive")
+    crawl_replay: bool = False
+    crawl_meta_ttl_sec: float = 86400.0
+    crawl_batch_max_inputs: int = 5000
+    live_ws_url: str | None = None
+    live_heartbeat_sec: float = 30.0
+    live_record_path: Path | None = None
+    live_queue_maxsize: int = 10000
+    live_batch_max: int = 500
+    live_flush_interval_sec: float = 1.0
+    live_max_duration_sec: float = 3600.0
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 16
+    http_keepalive_timeout_sec: float = 30.0
+    http_dns_cache_ttl_sec: int = 300
+    http_rate_per_host: float = 5.0
+    http_rate_min: float = 0.5
+    http_rate_max: float = 20.0
+    http_rate_burst: float = 5.0
+    http_max_retries: int = 4
+    http_backoff_base_sec: float = 1.0
+    http_backoff_max_sec: float = 60.0
 
 
 settings = Settings()
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Any
+
+
+class SegmentArchive:
+    def __init__(self, root: Path, compress_level: int = 6) -> None:
+        self._root = root
+        self._compress_level = compress_level
+
+    def put(self, cid: int, segment_index: int, payload: bytes) -> str:
+        digest = hashlib.sha256(payload).hexdigest()
+        obj_path = self._object_path(digest)
+        if not obj_path.exists():
+            _atomic_write(obj_path, zlib.compress(payload, self._compress_level))
+        _atomic_write(self._ref_path(cid, segment_index), digest.encode("ascii"))
+        return digest
+
+    def get(self, cid: int, segment_index: int) -> bytes | None:
+        ref_path = self._ref_path(cid, segment_index)
+        if not ref_path.exists():
+            return None
+        obj_path = self._object_path(ref_path.read_text(encoding="ascii").strip())
+        if not obj_path.exists():
+            return None
+        return zlib.decompress(obj_path.read_bytes())
+
+    def segment_indexes(self, cid: int) -> list[int]:
+        ref_dir = self._root / "refs" / str(cid)
+        if not ref_dir.exists():
+            return []
+        return sorted(int(p.name) for p in ref_dir.iterdir() if p.name.isdigit())
+
+    def put_meta(self, video_id: str, meta: dict[str, Any]) -> None:
+        _atomic_write(self._meta_path(video_id), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def get_meta(self, video_id: str) -> dict[str, Any] | None:
+        path = self._meta_path(video_id)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _object_path(self, digest: str) -> Path:
+        return self._root / "objects" / digest[:2] / f"{digest}.zz"
+
+    def _ref_path(self, cid: int, segment_index: int) -> Path:
+        return self._root / "refs" / str(int(cid)) / str(int(segment_index))
+
+    def _meta_path(self, video_id: str) -> Path:
+        return self._root / "videos" / (re.sub(r"[^0-9A-Za-z_.-]", "_", video_id) + ".json")
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
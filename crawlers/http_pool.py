@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+
+import aiohttp
+
+from config.settings import settings
+
+
+class HttpClientPool:
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 16,
+        keepalive_timeout_sec: float = 30.0,
+        dns_cache_ttl_sec: int = 300,
+    ) -> None:
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout_sec = keepalive_timeout_sec
+        self._dns_cache_ttl_sec = dns_cache_ttl_sec
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        session = self._session
+        loop = asyncio.get_running_loop()
+        if session is None or session.closed or self._loop is not loop:
+            if session is not None and not session.closed:
+                await _close_session(session, self._loop)
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout_sec,
+                ttl_dns_cache=self._dns_cache_ttl_sec,
+                use_dns_cache=True,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._session = session
+            self._loop = loop
+        return session
+
+    async def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await _close_session(session, self._loop)
+
+
+async def _close_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop | None) -> None:
+    if loop is not None and loop is not asyncio.get_running_loop() and loop.is_running():
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+        return
+    with contextlib.suppress(RuntimeError):
+        await session.close()
+
+
+http_pool = HttpClientPool(
+    limit=settings.http_pool_limit,
+    limit_per_host=settings.http_pool_limit_per_host,
+    keepalive_timeout_sec=settings.http_keepalive_timeout_sec,
+    dns_cache_ttl_sec=settings.http_dns_cache_ttl_sec,
+)
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from config.settings import settings
+from database.session import SessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "crawl_task"
+
+
+class _PostgresChannel:
+    def __init__(self, engine: Engine, channel: str) -> None:
+        self._engine = engine
+        self._channel = channel
+
+    def send(self) -> None:
+        with self._engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, '')"), {"channel": self._channel})
+            conn.commit()
+
+    async def listen(self, wake: Callable[[], None]) -> None:
+        import asyncpg
+
+        dsn = self._engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        conn = await asyncpg.connect(dsn)
+        try:
+            await conn.add_listener(self._channel, lambda *_: wake())
+            while not conn.is_closed():
+                await asyncio.sleep(5.0)
+        finally:
+            await conn.close()
+
+
+class _FileChannel:
+    def __init__(self, path: Path, check_interval_sec: float) -> None:
+        self._path = path
+        self._check_interval_sec = check_interval_sec
+        self._seen_mtime_ns = 0
+
+    def send(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_text(f"{os.getpid()} {time.time()}\n", encoding="ascii")
+        self._seen_mtime_ns = self._mtime_ns()
+
+    async def listen(self, wake: Callable[[], None]) -> None:
+        self._seen_mtime_ns = self._mtime_ns()
+        while True:
+            await asyncio.sleep(self._check_interval_sec)
+            mtime_ns = self._mtime_ns()
+            if mtime_ns != self._seen_mtime_ns:
+                self._seen_mtime_ns = mtime_ns
+                wake()
+
+    def _mtime_ns(self) -> int:
+        try:
+            return self._path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+
+class TaskNotifier:
+    def __init__(self, channel: _PostgresChannel | _FileChannel) -> None:
+        self._channel = channel
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._event: asyncio.Event | None = None
+        self._listener: asyncio.Task[None] | None = None
+        self._listen_supported = True
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    async def notify(self) -> None:
+        self._wake()
+        try:
+            await asyncio.to_thread(self._channel.send)
+        except Exception:
+            logger.warning("cross-process task notify failed", exc_info=True)
+
+    async def wait(self, since: int, timeout: float) -> None:
+        event = self._bind()
+        if self._listen_supported and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.create_task(self._listen())
+        if self._generation != since:
+            return
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+
+    async def close(self) -> None:
+        listener, self._listener = self._listener, None
+        if listener is not None and not listener.done():
+            listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await listener
+
+    def _bind(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._event is None or self._loop is not loop:
+            self._loop = loop
+            self._event = asyncio.Event()
+            self._listener = None
+        return self._event
+
+    def _wake(self) -> None:
+        self._generation += 1
+        event, self._event = self._event, None
+        if event is not None:
+            event.set()
+        if self._loop is not None:
+            self._event = asyncio.Event()
+
+    async def _listen(self) -> None:
+        try:
+            await self._channel.listen(self._wake)
+        except asyncio.CancelledError:
+            raise
+        except ImportError as e:
+            self._listen_supported = False
+            logger.warning("task notify listener unavailable (%s), falling back to polling", e)
+        except Exception:
+            logger.warning("task notify listener stopped, falling back to polling", exc_info=True)
+
+
+def create_task_notifier() -> TaskNotifier:
+    engine = SessionLocal.kw["bind"]
+    if engine.dialect.name == "postgresql":
+        return TaskNotifier(_PostgresChannel(engine, CHANNEL))
+    return TaskNotifier(_FileChannel(settings.scheduler_signal_path, settings.scheduler_signal_check_sec))
+
+
+task_notifier = create_task_notifier()
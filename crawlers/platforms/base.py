@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any
 
@@ -20,9 +21,84 @@ class DanmuEvent(BaseModel):
     raw_payload: dict[str, Any]
 
 
+@dataclass(slots=True)
+class DanmuBatch:
+    platform: str
+    video_id: str
+    page: int | None = None
+    cid: int | None = None
+    duration: float | None = None
+    segment_index: int | None = None
+    payload_hash: str | None = None
+    segment_done: bool = True
+    contents: list[str] = field(default_factory=list)
+    video_ts: list[float] = field(default_factory=list)
+    send_times: list[datetime | None] = field(default_factory=list)
+    user_ids: list[str | None] = field(default_factory=list)
+    raw_payloads: list[dict[str, Any]] = field(default_factory=list)
+    user_levels: list[int | None] | None = None
+    like_counts: list[int | None] | None = None
+    modes: list[int] | None = None
+    pools: list[int] | None = None
+    colors: list[int] | None = None
+    fontsizes: list[int] | None = None
+    weights: list[int] | None = None
+    extras: list[dict[str, Any]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def append_event(self, event: DanmuEvent) -> None:
+        if self.user_levels is None:
+            self.user_levels = [None] * len(self.contents)
+        if self.like_counts is None:
+            self.like_counts = [None] * len(self.contents)
+        self.contents.append(event.content)
+        self.video_ts.append(event.video_ts)
+        self.send_times.append(event.send_time)
+        self.user_ids.append(event.user_id)
+        self.raw_payloads.append(event.raw_payload)
+        self.user_levels.append(event.user_level)
+        self.like_counts.append(event.like_count)
+
+    def iter_events(self) -> Iterator[DanmuEvent]:
+        for i in range(len(self.contents)):
+            yield DanmuEvent(
+                platform=self.platform,
+                video_id=self.video_id,
+                content=self.contents[i],
+                video_ts=self.video_ts[i],
+                send_time=self.send_times[i],
+                user_id=self.user_ids[i],
+                user_level=self.user_levels[i] if self.user_levels is not None else None,
+                like_count=self.like_counts[i] if self.like_counts is not None else None,
+                raw_payload=self.raw_payload(i),
+            )
+
+    def raw_payload(self, i: int) -> dict[str, Any]:
+        if self.extras is None:
+            return self.raw_payloads[i]
+        payload = {"page": self.page, "cid": self.cid, "segment_index": self.segment_index, **self.extras[i]}
+        for name, values in (
+            ("mode", self.modes),
+            ("pool", self.pools),
+            ("color", self.colors),
+            ("fontsize", self.fontsizes),
+            ("weight", self.weights),
+        ):
+            if values is not None:
+                payload[name] = values[i]
+        payload["content"] = self.contents[i]
+        return payload
+
+
 class PlatformAdapter(ABC):
     platform: str
 
+    def __init__(self) -> None:
+        self.known_segment_hashes: dict[tuple[int, int], str] = {}
+        self.skipped_segments = 0
+
     @abstractmethod
     async def resolve_video(self, input_value: str) -> str:
         raise NotImplementedError
@@ -31,5 +107,32 @@ class PlatformAdapter(ABC):
     async def crawl_history(self, video_id: str, cursor: dict[str, Any] | None = None) -> AsyncIterator[DanmuEvent]:
         raise NotImplementedError
 
+    async def resolve_pages(self, video_id: str, cursor: dict[str, Any] | None = None) -> list[dict[str, Any]]:
+        return []
+
+    async def crawl_history_batches(
+        self, video_id: str, cursor: dict[str, Any] | None = None
+    ) -> AsyncIterator[DanmuBatch]:
+        batch: DanmuBatch | None = None
+        async for event in self.crawl_history(video_id, cursor=cursor):
+            cid = event.raw_payload.get("cid")
+            seg = event.raw_payload.get("segment_index")
+            if batch is not None and ((batch.cid, batch.segment_index) != (cid, seg) or len(batch) >= 2000):
+                batch.segment_done = (batch.cid, batch.segment_index) != (cid, seg)
+                yield batch
+                batch = None
+            if batch is None:
+                batch = DanmuBatch(
+                    platform=event.platform,
+                    video_id=event.video_id,
+                    page=event.raw_payload.get("page"),
+                    cid=cid,
+                    duration=event.raw_payload.get("duration"),
+                    segment_index=seg,
+                )
+            batch.append_event(event)
+        if batch is not None:
+            yield batch
+
     async def crawl_live(self, video_id: str) -> AsyncIterator[DanmuEvent]:
         raise NotImplementedError
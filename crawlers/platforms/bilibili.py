@@ -1,25 +1,78 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import hashlib
+import json
 import re
+import time
+from collections import deque
 from collections.abc import AsyncIterator
+from contextlib import aclosing
 from datetime import datetime, timezone
 from math import ceil
+from pathlib import Path
 from typing import Any
+from urllib.parse import urlsplit
 
 import aiohttp
 
-from crawlers.platforms.base import DanmuEvent, PlatformAdapter
+from crawlers.archive import SegmentArchive
+from crawlers.http_pool import HttpClientPool
+from crawlers.platforms.base import DanmuBatch, DanmuEvent, PlatformAdapter
+from crawlers.platforms.bilibili_live_proto import (
+    OP_AUTH,
+    OP_AUTH_REPLY,
+    OP_HEARTBEAT,
+    OP_MESSAGE,
+    PROTOVER_ZLIB,
+    pack_json,
+    pack_packet,
+    unpack_packets,
+)
 from crawlers.platforms.bilibili_proto import DmSegMobileReply
+from crawlers.rate_limit import THROTTLE_STATUSES, RateLimiterRegistry, backoff_delay, parse_retry_after
+from monitoring import metrics
+
+
+_pages_inflight: dict[tuple[int, str, str], asyncio.Future[list[dict[str, Any]]]] = {}
 
 
 class BilibiliAdapter(PlatformAdapter):
     platform = "bilibili"
 
-    def __init__(self, session: aiohttp.ClientSession | None = None) -> None:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession | None = None,
+        pool: HttpClientPool | None = None,
+        segment_concurrency: int = 1,
+        limiters: RateLimiterRegistry | None = None,
+        max_retries: int = 4,
+        backoff_base_sec: float = 1.0,
+        backoff_max_sec: float = 60.0,
+        archive: SegmentArchive | None = None,
+        live_ws_url: str | None = None,
+        live_heartbeat_sec: float = 30.0,
+        live_record_path: Path | None = None,
+    ) -> None:
+        super().__init__()
         self._session = session
+        self._archive = archive
+        self._live_ws_url = live_ws_url
+        self._live_heartbeat_sec = live_heartbeat_sec
+        self._live_record_path = live_record_path
+        self._pool = pool
+        self._limiters = limiters
+        self._max_retries = max_retries
+        self._backoff_base_sec = backoff_base_sec
+        self._backoff_max_sec = backoff_max_sec
+        self._segment_concurrency = max(1, int(segment_concurrency))
 
     async def resolve_video(self, input_value: str) -> str:
         input_value = input_value.strip()
+        room_id = self._extract_live_room(input_value)
+        if room_id:
+            return f"live:{room_id}"
         bvid = self._extract_bvid(input_value)
         if bvid:
             return bvid
@@ -31,86 +84,304 @@ class BilibiliAdapter(PlatformAdapter):
         return input_value
 
     async def crawl_history(self, video_id: str, cursor: dict[str, Any] | None = None) -> AsyncIterator[DanmuEvent]:
+        batches = self.crawl_history_batches(video_id, cursor=cursor)
+        async with aclosing(batches):
+            async for batch in batches:
+                for event in batch.iter_events():
+                    yield event
+
+    async def crawl_history_batches(self, video_id: str, cursor: dict[str, Any] | None = None) -> AsyncIterator[DanmuBatch]:
+        pages = await self.resolve_pages(video_id, cursor)
+        if not pages:
+            raise ValueError(f"无法解析 cid: {video_id}")
+
+        fetch_slots = asyncio.Semaphore(self._segment_concurrency)
+        page_slots = asyncio.Semaphore(self._segment_concurrency)
+        queue: asyncio.Queue[DanmuBatch] = asyncio.Queue(maxsize=self._segment_concurrency * 2)
+
+        async def run_page(page: dict[str, Any]) -> None:
+            async with page_slots:
+                page_batches = self._crawl_page(video_id, page, fetch_slots)
+                async with aclosing(page_batches):
+                    async for batch in page_batches:
+                        await queue.put(batch)
+
+        workers = [asyncio.create_task(run_page(page)) for page in pages]
+        all_done = asyncio.gather(*workers)
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, all_done}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                while not queue.empty():
+                    yield queue.get_nowait()
+                all_done.result()
+                break
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if not all_done.cancelled() and all_done.done():
+                all_done.exception()
+
+    async def resolve_pages(self, video_id: str, cursor: dict[str, Any] | None = None) -> list[dict[str, Any]]:
         cursor = cursor or {}
+        if cursor.get("pages"):
+            return [dict(page) for page in cursor["pages"]]
         cid = cursor.get("cid")
         duration = cursor.get("duration")
-        if cid is None or duration is None:
-            resolved = await self._resolve_cid_and_duration(video_id)
-            cid = resolved.get("cid") or cid
-            duration = resolved.get("duration") or duration
-        if cid is None:
-            raise ValueError(f"无法解析 cid: {video_id}")
+        if cid is not None and duration is not None:
+            return [{"page": 1, "cid": int(cid), "duration": duration, "segment_index": int(cursor.get("segment_index") or 1)}]
+        key = (id(asyncio.get_running_loop()), type(self).__name__, video_id)
+        resolving = _pages_inflight.get(key)
+        if resolving is None:
+            resolving = asyncio.ensure_future(self._resolve_pages(video_id))
+            _pages_inflight[key] = resolving
+            resolving.add_done_callback(lambda _: _pages_inflight.pop(key, None))
+        return [dict(page) for page in await asyncio.shield(resolving)]
 
-        start_segment_index = int(cursor.get("segment_index") or 1)
+    async def _crawl_page(self, video_id: str, page: dict[str, Any], fetch_slots: asyncio.Semaphore) -> AsyncIterator[DanmuBatch]:
+        cid = int(page["cid"])
+        page_no = page.get("page")
+        duration = page.get("duration")
+        duration = float(duration) if isinstance(duration, (int, float)) else None
+        start_segment_index = int(page.get("segment_index") or 1)
         max_segments = None
-        if isinstance(duration, (int, float)) and duration > 0:
-            max_segments = ceil(float(duration) / 360.0)
+        if duration is not None and duration > 0:
+            max_segments = ceil(duration / 360.0)
 
         empty_streak = 0
-        segment_index = start_segment_index
-        while True:
-            if max_segments is not None and segment_index > max_segments:
-                break
-            payload = await self._fetch_seg(cid=int(cid), segment_index=segment_index)
-            reply = DmSegMobileReply.FromString(payload)
-            if not getattr(reply, "elems", None):
-                empty_streak += 1
-                if max_segments is not None or empty_streak >= 3:
-                    break
+        segments = self._iter_segment_payloads(cid, start_segment_index, max_segments, fetch_slots)
+        async with aclosing(segments):
+            async for segment_index, payload in segments:
+                metrics.crawl_segments.inc(platform=self.platform)
+                metrics.crawl_bytes.inc(len(payload), platform=self.platform)
+                payload_hash = hashlib.blake2b(payload, digest_size=16).hexdigest()
+                if payload and self.known_segment_hashes.get((cid, segment_index)) == payload_hash:
+                    self.skipped_segments += 1
+                    metrics.crawl_segments_skipped.inc(platform=self.platform)
+                    empty_streak = 0
+                    continue
+                decode_started = time.perf_counter()
+                reply = DmSegMobileReply.FromString(payload)
+                if not reply.elems:
+                    empty_streak += 1
+                    if max_segments is not None or empty_streak >= 3:
+                        break
+                    continue
+                empty_streak = 0
+                batch = self._decode_batch(video_id, page_no, cid, duration, segment_index, payload_hash, reply)
+                metrics.crawl_decode_seconds.observe(time.perf_counter() - decode_started, platform=self.platform)
+                yield batch
+
+    def _decode_batch(
+        self,
+        video_id: str,
+        page: int | None,
+        cid: int,
+        duration: float | None,
+        segment_index: int,
+        payload_hash: str,
+        reply: Any,
+    ) -> DanmuBatch:
+        batch = DanmuBatch(
+            platform=self.platform,
+            video_id=video_id,
+            page=page,
+            cid=cid,
+            duration=duration,
+            segment_index=segment_index,
+            payload_hash=payload_hash,
+        )
+        contents = batch.contents
+        video_ts = batch.video_ts
+        send_times = batch.send_times
+        user_ids = batch.user_ids
+        modes = batch.modes = []
+        pools = batch.pools = []
+        colors = batch.colors = []
+        fontsizes = batch.fontsizes = []
+        weights = batch.weights = []
+        extras = batch.extras = []
+        fromtimestamp = datetime.fromtimestamp
+        utc = timezone.utc
+        for elem in reply.elems:
+            progress_ms = elem.progress
+            ctime = elem.ctime
+            mid_hash = elem.midHash
+            contents.append(elem.content)
+            video_ts.append(progress_ms / 1000.0)
+            send_times.append(fromtimestamp(ctime, tz=utc) if ctime > 0 else None)
+            user_ids.append(mid_hash or None)
+            modes.append(elem.mode)
+            pools.append(elem.pool)
+            colors.append(elem.color)
+            fontsizes.append(elem.fontsize)
+            weights.append(elem.weight)
+            extras.append(
+                {"duration": duration, "id": elem.id, "progress": progress_ms, "midHash": mid_hash, "ctime": ctime, "attr": elem.attr}
+            )
+        return batch
+
+    async def crawl_live(self, video_id: str) -> AsyncIterator[DanmuEvent]:
+        room_id = self._extract_live_room(video_id)
+        if room_id is None:
+            raise ValueError(f"无法解析直播间号: {video_id}")
+        ws_url, token, room_id = await self._resolve_live_endpoint(room_id)
+        session = await self._get_session()
+        headers = {"User-Agent": _DEFAULT_UA, "Referer": "https://live.bilibili.com"}
+        record = self._live_record_path.open("a", encoding="ascii") if self._live_record_path is not None else None
+        started = time.monotonic()
+        try:
+            receive_timeout = self._live_heartbeat_sec * 3
+            async with session.ws_connect(ws_url, headers=headers, receive_timeout=receive_timeout) as ws:
+                auth = {"uid": 0, "roomid": room_id, "protover": PROTOVER_ZLIB, "platform": "web", "type": 2, "key": token}
+                await ws.send_bytes(pack_json(OP_AUTH, auth))
+                await self._check_live_auth(ws, room_id)
+                heartbeat = asyncio.create_task(self._live_heartbeat(ws))
+                try:
+                    while True:
+                        try:
+                            msg = await ws.receive()
+                        except asyncio.TimeoutError as e:
+                            raise TimeoutError(f"直播间 {room_id} 超过 {receive_timeout:g} 秒没有收到数据") from e
+                        if msg.type != aiohttp.WSMsgType.BINARY:
+                            if msg.type in _WS_CLOSED_TYPES:
+                                break
+                            continue
+                        if record is not None:
+                            record.write(base64.b64encode(msg.data).decode("ascii") + "\n")
+                        for op, body in unpack_packets(msg.data):
+                            if op != OP_MESSAGE or not isinstance(body, dict):
+                                continue
+                            event = self._live_event(video_id, room_id, body, time.monotonic() - started)
+                            if event is not None:
+                                yield event
+                finally:
+                    heartbeat.cancel()
+        finally:
+            if record is not None:
+                record.close()
+
+    @staticmethod
+    async def _check_live_auth(ws: aiohttp.ClientWebSocketResponse, room_id: int) -> None:
+        msg = await ws.receive()
+        if msg.type == aiohttp.WSMsgType.BINARY:
+            for op, body in unpack_packets(msg.data):
+                if op != OP_AUTH_REPLY:
+                    continue
+                code = body.get("code") if isinstance(body, dict) else None
+                if code != 0:
+                    raise PermissionError(f"直播间鉴权失败: room_id={room_id} code={code}")
+                return
+        raise ConnectionError(f"直播间鉴权未收到回复: room_id={room_id} type={msg.type}")
+
+    async def _live_heartbeat(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        while not ws.closed:
+            try:
+                await ws.send_bytes(pack_packet(OP_HEARTBEAT))
+            except (ConnectionResetError, aiohttp.ClientError):
+                return
+            await asyncio.sleep(self._live_heartbeat_sec)
+
+    async def _resolve_live_endpoint(self, room_id: int) -> tuple[str, str, int]:
+        if self._live_ws_url:
+            return self._live_ws_url, "", room_id
+        init = json.loads(await self._get_bytes("https://api.live.bilibili.com/room/v1/Room/room_init", {"id": room_id}))
+        room_id = int((init.get("data") or {}).get("room_id") or room_id)
+        info = json.loads(
+            await self._get_bytes("https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo", {"id": room_id, "type": 0})
+        )
+        data = info.get("data") or {}
+        hosts = data.get("host_list") or []
+        if not hosts:
+            return "wss://broadcastlv.chat.bilibili.com/sub", str(data.get("token") or ""), room_id
+        host = hosts[0]
+        return f"wss://{host.get('host')}:{host.get('wss_port') or 443}/sub", str(data.get("token") or ""), room_id
+
+    def _live_event(self, video_id: str, room_id: int, body: dict[str, Any], elapsed_sec: float) -> DanmuEvent | None:
+        if not str(body.get("cmd", "")).startswith("DANMU_MSG"):
+            return None
+        try:
+            info = body["info"]
+            meta = info[0]
+            content = str(info[1])
+            uid = info[2][0]
+            ts_ms = int(meta[4] or 0)
+            user_level = int(info[4][0]) if len(info) > 4 and info[4] else None
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+        mid_hash = str(meta[7]) if len(meta) > 7 and isinstance(meta[7], str) else ""
+        user_id = str(uid) if uid else (mid_hash or None)
+        raw_payload = {
+            "room_id": room_id,
+            "mode": int(meta[1] or 0),
+            "fontsize": int(meta[2] or 0),
+            "color": int(meta[3] or 0),
+            "midHash": mid_hash,
+            "content": content,
+            "ctime": ts_ms // 1000,
+        }
+        return DanmuEvent(
+            platform=self.platform,
+            video_id=video_id,
+            content=content,
+            video_ts=max(0.0, elapsed_sec),
+            send_time=datetime.fromtimestamp(ts_ms / 1000.0, tz=timezone.utc) if ts_ms > 0 else None,
+            user_id=user_id,
+            user_level=user_level,
+            like_count=None,
+            raw_payload=raw_payload,
+        )
+
+    async def _iter_segment_payloads(
+        self, cid: int, start_segment_index: int, max_segments: int | None, fetch_slots: asyncio.Semaphore
+    ) -> AsyncIterator[tuple[int, bytes]]:
+        async def fetch(segment_index: int) -> bytes:
+            async with fetch_slots:
+                return await self._fetch_seg(cid=cid, segment_index=segment_index)
+
+        if max_segments is None or self._segment_concurrency <= 1:
+            segment_index = start_segment_index
+            while max_segments is None or segment_index <= max_segments:
+                yield segment_index, await fetch(segment_index)
                 segment_index += 1
-                continue
-            empty_streak = 0
-            for elem in reply.elems:
-                content = getattr(elem, "content", "") or ""
-                progress_ms = int(getattr(elem, "progress", 0) or 0)
-                ctime = int(getattr(elem, "ctime", 0) or 0)
-                send_time = datetime.fromtimestamp(ctime, tz=timezone.utc) if ctime > 0 else None
-                raw_payload = {
-                    "cid": int(cid),
-                    "duration": float(duration) if isinstance(duration, (int, float)) else None,
-                    "segment_index": segment_index,
-                    "id": int(getattr(elem, "id", 0) or 0),
-                    "progress": progress_ms,
-                    "mode": int(getattr(elem, "mode", 0) or 0),
-                    "fontsize": int(getattr(elem, "fontsize", 0) or 0),
-                    "color": int(getattr(elem, "color", 0) or 0),
-                    "midHash": str(getattr(elem, "midHash", "") or ""),
-                    "content": content,
-                    "ctime": ctime,
-                    "weight": int(getattr(elem, "weight", 0) or 0),
-                    "pool": int(getattr(elem, "pool", 0) or 0),
-                    "attr": int(getattr(elem, "attr", 0) or 0),
-                }
-                yield DanmuEvent(
-                    platform=self.platform,
-                    video_id=video_id,
-                    content=content,
-                    video_ts=progress_ms / 1000.0,
-                    send_time=send_time,
-                    user_id=raw_payload.get("midHash") or None,
-                    user_level=None,
-                    like_count=None,
-                    raw_payload=raw_payload,
-                )
-            segment_index += 1
+            return
+
+        pending: deque[tuple[int, asyncio.Task[bytes]]] = deque()
+        next_index = start_segment_index
+        try:
+            while pending or next_index <= max_segments:
+                while len(pending) < self._segment_concurrency and next_index <= max_segments:
+                    pending.append((next_index, asyncio.create_task(fetch(next_index))))
+                    next_index += 1
+                segment_index, task = pending.popleft()
+                yield segment_index, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
 
     async def _fetch_seg(self, cid: int, segment_index: int) -> bytes:
         url = "https://api.bilibili.com/x/v2/dm/web/seg.so"
         params = {"type": 1, "oid": cid, "segment_index": segment_index}
-        session = await self._get_session()
-        headers = {"User-Agent": _DEFAULT_UA, "Referer": "https://www.bilibili.com"}
-        async with session.get(url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-            resp.raise_for_status()
-            return await resp.read()
+        payload = await self._get_bytes(url, params)
+        if self._archive is not None:
+            await asyncio.to_thread(self._archive.put, cid, segment_index, payload)
+        return payload
 
-    async def _resolve_cid_and_duration(self, video_id: str) -> dict[str, Any]:
+    async def _resolve_pages(self, video_id: str) -> list[dict[str, Any]]:
         bvid = self._extract_bvid(video_id)
         avid = self._extract_avid(video_id)
         if not bvid and not avid:
             m = re.fullmatch(r"cid:(\d+)", video_id)
             if m:
-                return {"cid": int(m.group(1)), "duration": None}
-            return {}
+                return [{"page": 1, "cid": int(m.group(1)), "duration": None}]
+            return []
 
         url = "https://api.bilibili.com/x/web-interface/view"
         params: dict[str, str] = {}
@@ -118,23 +389,52 @@ class BilibiliAdapter(PlatformAdapter):
             params["bvid"] = bvid
         else:
             params["aid"] = avid.removeprefix("av")
-        session = await self._get_session()
-        headers = {"User-Agent": _DEFAULT_UA, "Referer": "https://www.bilibili.com"}
-        async with session.get(url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-            resp.raise_for_status()
-            data = await resp.json()
+        data = json.loads(await self._get_bytes(url, params))
         if data.get("code") != 0:
-            return {}
+            return []
         view_data = data.get("data") or {}
-        pages = view_data.get("pages") or []
-        if not pages:
-            return {}
-        page0 = pages[0] or {}
-        return {"cid": int(page0.get("cid")), "duration": float(page0.get("duration") or 0)}
+        pages = [
+            {"page": int(p.get("page") or i), "cid": int(p["cid"]), "duration": float(p.get("duration") or 0)}
+            for i, p in enumerate(view_data.get("pages") or [], start=1)
+            if p and p.get("cid")
+        ]
+        if pages and self._archive is not None:
+            await asyncio.to_thread(self._archive.put_meta, video_id, {"pages": pages})
+        return pages
+
+    async def _get_bytes(self, url: str, params: dict[str, Any]) -> bytes:
+        limiter = self._limiters.get(urlsplit(url).hostname or "") if self._limiters is not None else None
+        session = await self._get_session()
+        headers = {"User-Agent": _DEFAULT_UA, "Referer": "https://www.bilibili.com"}
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await limiter.acquire()
+            retry_after: float | None = None
+            try:
+                async with session.get(url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                    retryable = resp.status in THROTTLE_STATUSES or resp.status >= 500
+                    if not retryable or attempt >= self._max_retries:
+                        resp.raise_for_status()
+                        payload = await resp.read()
+                        if limiter is not None:
+                            limiter.on_success()
+                        return payload
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    if limiter is not None and resp.status in THROTTLE_STATUSES:
+                        limiter.on_throttled(retry_after)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self._max_retries:
+                    raise
+            await asyncio.sleep(backoff_delay(attempt, self._backoff_base_sec, self._backoff_max_sec, retry_after))
+            attempt += 1
 
     async def _get_session(self) -> aiohttp.ClientSession:
-        if self._session is None:
-            self._session = aiohttp.ClientSession()
+        if self._session is not None:
+            return self._session
+        if self._pool is not None:
+            return await self._pool.get_session()
+        self._session = aiohttp.ClientSession()
         return self._session
 
     @staticmethod
@@ -142,10 +442,38 @@ class BilibiliAdapter(PlatformAdapter):
         m = re.search(r"(BV[0-9A-Za-z]{10})", text)
         return m.group(1) if m else None
 
+    @staticmethod
+    def _extract_live_room(text: str) -> int | None:
+        m = re.fullmatch(r"live:(\d+)", text) or re.search(r"live\.bilibili\.com/(?:h5/)?(\d+)", text)
+        return int(m.group(1)) if m else None
+
     @staticmethod
     def _extract_avid(text: str) -> str | None:
         m = re.search(r"(av\d+)", text, flags=re.IGNORECASE)
         return m.group(1).lower() if m else None
 
 
+class BilibiliReplayAdapter(BilibiliAdapter):
+    def __init__(self, archive: SegmentArchive, segment_concurrency: int = 1) -> None:
+        super().__init__(segment_concurrency=segment_concurrency)
+        self._replay_archive = archive
+
+    async def _fetch_seg(self, cid: int, segment_index: int) -> bytes:
+        payload = await asyncio.to_thread(self._replay_archive.get, cid, segment_index)
+        return payload or b""
+
+    async def _resolve_pages(self, video_id: str) -> list[dict[str, Any]]:
+        meta = await asyncio.to_thread(self._replay_archive.get_meta, video_id)
+        if meta and meta.get("pages"):
+            return meta["pages"]
+        if meta and meta.get("cid") is not None:
+            return [{"page": 1, "cid": int(meta["cid"]), "duration": meta.get("duration")}]
+        m = re.fullmatch(r"cid:(\d+)", video_id)
+        if m:
+            return [{"page": 1, "cid": int(m.group(1)), "duration": None}]
+        raise ValueError(f"归档中没有该视频的元数据: {video_id}")
+
+
+_WS_CLOSED_TYPES = (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR)
+
 _DEFAULT_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
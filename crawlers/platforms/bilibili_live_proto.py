@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+import struct
+import zlib
+from collections.abc import Iterator
+from typing import Any
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_AUTH = 7
+OP_AUTH_REPLY = 8
+
+PROTOVER_JSON = 0
+PROTOVER_INT = 1
+PROTOVER_ZLIB = 2
+PROTOVER_BROTLI = 3
+
+_HEADER = struct.Struct(">IHHII")
+
+
+def pack_packet(op: int, body: bytes = b"", protover: int = PROTOVER_INT, seq: int = 1) -> bytes:
+    return _HEADER.pack(_HEADER.size + len(body), _HEADER.size, protover, op, seq) + body
+
+
+def pack_json(op: int, value: dict[str, Any], protover: int = PROTOVER_JSON) -> bytes:
+    return pack_packet(op, json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), protover=protover)
+
+
+def unpack_packets(data: bytes) -> Iterator[tuple[int, Any]]:
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        total_len, header_len, protover, op, _ = _HEADER.unpack_from(data, offset)
+        if total_len < header_len:
+            return
+        body = data[offset + header_len : offset + total_len]
+        offset += total_len
+        if op == OP_MESSAGE and protover == PROTOVER_ZLIB:
+            yield from unpack_packets(zlib.decompress(body))
+        elif op == OP_MESSAGE and protover == PROTOVER_BROTLI:
+            if brotli is not None:
+                yield from unpack_packets(brotli.decompress(body))
+        elif op == OP_HEARTBEAT_REPLY:
+            yield op, int.from_bytes(body[:4], "big") if len(body) >= 4 else 0
+        elif op in (OP_MESSAGE, OP_AUTH_REPLY):
+            try:
+                yield op, json.loads(body.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                continue
+        else:
+            yield op, body
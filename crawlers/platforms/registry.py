@@ -2,15 +2,39 @@ from __future__ import annotations
 
 from typing import Any
 
+from config.settings import settings
+from crawlers.archive import SegmentArchive
+from crawlers.http_pool import http_pool
 from crawlers.platforms.base import PlatformAdapter
-from crawlers.platforms.bilibili import BilibiliAdapter
+from crawlers.platforms.bilibili import BilibiliAdapter, BilibiliReplayAdapter
 from crawlers.platforms.douyin import DouyinAdapter
 from crawlers.platforms.youtube import YouTubeAdapter
+from crawlers.rate_limit import rate_limiters
 
 
 def create_adapter(platform: str, **kwargs: Any) -> PlatformAdapter:
     if platform == "bilibili":
-        return BilibiliAdapter(session=kwargs.get("session"))
+        if kwargs.get("replay", settings.crawl_replay):
+            return BilibiliReplayAdapter(
+                archive=kwargs.get("archive") or SegmentArchive(settings.crawl_archive_dir),
+                segment_concurrency=kwargs.get("segment_concurrency", settings.crawl_segment_concurrency),
+            )
+        archive = kwargs.get("archive")
+        if archive is None and settings.crawl_archive_enabled:
+            archive = SegmentArchive(settings.crawl_archive_dir)
+        return BilibiliAdapter(
+            session=kwargs.get("session"),
+            pool=kwargs.get("pool", http_pool),
+            segment_concurrency=kwargs.get("segment_concurrency", settings.crawl_segment_concurrency),
+            limiters=kwargs.get("limiters", rate_limiters),
+            max_retries=settings.http_max_retries,
+            backoff_base_sec=settings.http_backoff_base_sec,
+            backoff_max_sec=settings.http_backoff_max_sec,
+            archive=archive,
+            live_ws_url=settings.live_ws_url,
+            live_heartbeat_sec=settings.live_heartbeat_sec,
+            live_record_path=settings.live_record_path,
+        )
     if platform == "youtube":
         return YouTubeAdapter()
     if platform == "douyin":
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from typing import Any
+
+from config.settings import settings
+
+
+THROTTLE_STATUSES = frozenset({412, 429})
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        burst: float,
+        increase_step: float = 0.1,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self._rate = rate
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._burst = burst
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self.throttled_count = 0
+
+    @property
+    def current_rate(self) -> float:
+        return self._rate
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+        self._tokens -= 1.0
+        wait = max(self._blocked_until - now, -self._tokens / self._rate if self._tokens < 0 else 0.0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        self._rate = min(self._max_rate, self._rate + self._increase_step)
+
+    def on_throttled(self, retry_after_sec: float | None = None) -> None:
+        self.throttled_count += 1
+        self._rate = max(self._min_rate, self._rate * self._decrease_factor)
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after_sec:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after_sec)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"rate": self._rate, "min_rate": self._min_rate, "max_rate": self._max_rate, "throttled": self.throttled_count}
+
+
+class RateLimiterRegistry:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, burst: float) -> None:
+        self._rate = rate
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._burst = burst
+        self._limiters: dict[str, AdaptiveRateLimiter] = {}
+
+    def get(self, host: str) -> AdaptiveRateLimiter:
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(rate=self._rate, min_rate=self._min_rate, max_rate=self._max_rate, burst=self._burst)
+            self._limiters[host] = limiter
+        return limiter
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {host: limiter.snapshot() for host, limiter in sorted(self._limiters.items())}
+
+
+def backoff_delay(attempt: int, base_sec: float, max_sec: float, retry_after_sec: float | None = None) -> float:
+    delay = min(max_sec, base_sec * (2**attempt)) * random.uniform(0.5, 1.5)
+    if retry_after_sec:
+        delay = max(delay, retry_after_sec)
+    return delay
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+rate_limiters = RateLimiterRegistry(
+    rate=settings.http_rate_per_host,
+    min_rate=settings.http_rate_min,
+    max_rate=settings.http_rate_max,
+    burst=settings.http_rate_burst,
+)
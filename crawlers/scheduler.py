@@ -1,123 +1,512 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import logging
-from datetime import datetime
+import os
+import socket
+import time
+import uuid
+from collections.abc import Coroutine
+from datetime import datetime, timezone
+from functools import partial
 from typing import Any
 
-import aiohttp
 from sqlalchemy.orm import Session
 
+from config.settings import settings
+from crawlers.http_pool import http_pool
+from crawlers.notifier import task_notifier
+from crawlers.platforms.base import DanmuBatch, DanmuEvent, PlatformAdapter
 from crawlers.platforms.registry import create_adapter
-from crawlers.utils import dedup_hash, user_hash
-from database.models import RawDanmu
+from crawlers.utils import dedup_key, user_hash
+from crawlers.writer import DbWriter
+from database.raw_payload import encode_extra, split_raw_payload
 from database.repositories.crawl_task_repo import CrawlTaskRepository
 from database.repositories.raw_danmu_repo import RawDanmuRepository
+from database.repositories.segment_fingerprint_repo import SegmentFingerprintRepository
+from database.repositories.video_repo import VideoRepository
 from database.session import SessionLocal
+from database.sharding import shard_session
+from monitoring import metrics
 
 
 logger = logging.getLogger(__name__)
 
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
-async def run_pending_tasks_once(limit: int = 3) -> int:
-    processed = 0
+
+class LeaseLostError(RuntimeError):
+    pass
+
+
+async def run_pending_tasks_once(limit: int | None = None) -> int:
+    claimed = await asyncio.to_thread(_claim_pending, limit or settings.crawl_worker_count)
+    await asyncio.gather(*(_execute_task(task_id, lease_token, retry_count) for task_id, lease_token, retry_count in claimed))
+    return len(claimed)
+
+
+def _claim_pending(limit: int) -> list[tuple[int, str, int]]:
     db: Session = SessionLocal()
     try:
         task_repo = CrawlTaskRepository(db)
-        pending = task_repo.list_pending(limit=limit)
-        for task in pending:
-            processed += 1
-            try:
-                task_repo.update_status(task.id, "RUNNING")
-                db.commit()
-                await _run_one_task(db=db, task_id=task.id)
-                task_repo.update_status(task.id, "SUCCEEDED")
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                task_repo.update_status(task.id, "FAILED", last_error=str(e), retry_count=(task.retry_count or 0) + 1)
-                db.commit()
-                logger.exception("task failed: %s", task.id)
+        with metrics.scheduler_claim_seconds.time():
+            tasks = task_repo.claim(
+                worker_id=WORKER_ID,
+                limit=limit,
+                lease_sec=settings.crawl_lease_sec,
+                aging_sec=settings.crawl_priority_aging_sec,
+                deadline_window_sec=settings.crawl_deadline_window_sec,
+                max_running_per_platform=settings.crawl_max_running_per_platform,
+                max_running_per_submitter=settings.crawl_max_running_per_submitter,
+            )
+        claimed = [(task.id, task.worker_id, task.retry_count or 0) for task in tasks]
+        for task in tasks:
+            if task.started_at is not None:
+                metrics.scheduler_task_wait_seconds.observe(_seconds_between(task.created_at, task.started_at))
+        metrics.scheduler_queue_depth.replace({(priority,): count for priority, count in task_repo.pending_by_priority().items()})
+        db.commit()
+        return claimed
     finally:
         db.close()
-    return processed
 
 
-async def _run_one_task(db: Session, task_id: int) -> None:
-    task_repo = CrawlTaskRepository(db)
-    task = task_repo.get(task_id)
+async def _execute_task(task_id: int, lease_token: str, retry_count: int) -> None:
+    started = time.perf_counter()
+    status = "SUCCEEDED"
+    try:
+        await _run_with_lease(task_id, lease_token, _run_one_task(task_id=task_id, lease_token=lease_token))
+        if not await asyncio.to_thread(_release, task_id, lease_token, "SUCCEEDED"):
+            raise LeaseLostError(f"任务租约已失效: {task_id}")
+    except LeaseLostError:
+        status = "LEASE_LOST"
+        logger.warning("task lease lost, abandoned: %s", task_id)
+    except Exception as e:
+        status = "FAILED"
+        logger.exception("task failed: %s", task_id)
+        if not await asyncio.to_thread(_release, task_id, lease_token, "FAILED", str(e), retry_count + 1):
+            status = "LEASE_LOST"
+            logger.warning("task lease lost before failure was recorded: %s", task_id)
+    finally:
+        metrics.scheduler_task_seconds.observe(time.perf_counter() - started, status=status)
+
+
+def _release(task_id: int, lease_token: str, status: str, last_error: str | None = None, retry_count: int | None = None) -> bool:
+    db: Session = SessionLocal()
+    try:
+        if not CrawlTaskRepository(db).release(task_id, lease_token, status, last_error=last_error, retry_count=retry_count):
+            db.rollback()
+            return False
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+async def _run_with_lease(task_id: int, lease_token: str, coro: Coroutine[Any, Any, None]) -> None:
+    crawl = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({crawl}, timeout=settings.crawl_lease_sec / 3)
+            if done:
+                return crawl.result()
+            if not await asyncio.to_thread(_renew_lease, task_id, lease_token):
+                raise LeaseLostError(f"任务租约已失效: {task_id}")
+    finally:
+        if not crawl.done():
+            crawl.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await crawl
+
+
+def _renew_lease(task_id: int, lease_token: str) -> bool:
+    db: Session = SessionLocal()
+    try:
+        renewed = CrawlTaskRepository(db).renew_lease(task_id, lease_token=lease_token, lease_sec=settings.crawl_lease_sec)
+        db.commit()
+        return renewed
+    finally:
+        db.close()
+
+
+async def _run_one_task(task_id: int, lease_token: str) -> None:
+    task = await asyncio.to_thread(_read_task, task_id)
     if task is None:
         return
-    async with aiohttp.ClientSession() as session:
-        adapter = create_adapter(task.platform, session=session)
-        canonical_video_id = await adapter.resolve_video(task.video_id)
-        cursor: dict[str, Any] = dict(task.cursor_json or {})
-        raw_repo = RawDanmuRepository(db)
-
-        current_segment: int | None = None
-        inserted_since_commit = 0
-        last_cursor: dict[str, Any] = dict(cursor)
-        async for event in adapter.crawl_history(canonical_video_id, cursor=cursor):
-            seg = event.raw_payload.get("segment_index")
-            if isinstance(seg, int):
-                if current_segment is None:
-                    current_segment = seg
-                elif seg != current_segment:
-                    await _commit_segment(db, task_repo, task_id, last_cursor, inserted_since_commit, current_segment)
-                    inserted_since_commit = 0
-                    current_segment = seg
-            user_id_h = user_hash(event.platform, event.user_id)
-            d_hash = dedup_hash(event.platform, canonical_video_id, event.content, event.video_ts, user_id_h)
-            item = RawDanmu(
-                platform=event.platform,
-                video_id=canonical_video_id,
-                content=event.content,
-                video_ts=event.video_ts,
-                send_time=event.send_time,
-                user_id_hash=user_id_h,
-                user_level=event.user_level,
-                like_count=event.like_count,
-                dedup_hash=d_hash,
-                raw_json=event.raw_payload,
+    task["lease_token"] = lease_token
+    adapter = create_adapter(task["platform"])
+    canonical_video_id = await adapter.resolve_video(task["video_id"])
+    writer = DbWriter(partial(shard_session, task["platform"], canonical_video_id))
+    try:
+        if task["task_type"] == "live":
+            await _run_live_task(writer, task, adapter, canonical_video_id)
+        else:
+            await _run_history_task(writer, task, adapter, canonical_video_id)
+    finally:
+        await writer.close()
+
+
+async def _run_history_task(writer: DbWriter, task: dict[str, Any], adapter: PlatformAdapter, video_id: str) -> None:
+    task_id = task["id"]
+    platform = task["platform"]
+    cursor: dict[str, Any] = dict(task["cursor_json"] or {})
+    needs_pages = not cursor.get("pages") and cursor.get("cid") is None
+    seen_keys, known_hashes, cached_pages = await writer.call(
+        partial(
+            _load_crawl_state,
+            platform=platform,
+            video_id=video_id,
+            load_hashes=not cursor.get("full_recrawl"),
+            load_pages=needs_pages,
+        )
+    )
+    adapter.known_segment_hashes = known_hashes
+    if cached_pages:
+        cursor["pages"] = cached_pages
+        needs_pages = False
+    pages = await adapter.resolve_pages(video_id, cursor)
+    if pages:
+        if needs_pages:
+            await writer.call(partial(_store_pages, platform=platform, video_id=video_id, pages=pages))
+        cursor["pages"] = pages
+        for key in ("cid", "duration", "segment_index"):
+            cursor.pop(key, None)
+
+    queue: asyncio.Queue[DanmuBatch] = asyncio.Queue(maxsize=settings.crawl_write_queue_size)
+    producer = asyncio.create_task(_produce_batches(adapter, video_id, cursor, queue))
+    last_cursor: dict[str, Any] = dict(cursor)
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                producer.result()
+                if queue.empty():
+                    break
+                continue
+            batch = getter.result()
+            if batch.segment_index is not None and batch.segment_done:
+                last_cursor = _advance_cursor(last_cursor, batch)
+            await writer.call(
+                partial(
+                    _write_batch,
+                    task_id=task_id,
+                    lease_token=task["lease_token"],
+                    video_id=video_id,
+                    batch=batch,
+                    seen_keys=seen_keys,
+                    cursor=last_cursor,
+                )
             )
-            inserted = raw_repo.insert_one(item)
-            if inserted:
-                inserted_since_commit += 1
-            last_cursor = _cursor_from_event(last_cursor, event.raw_payload)
-            if inserted_since_commit >= 2000:
-                db.commit()
-                inserted_since_commit = 0
-
-        if inserted_since_commit > 0:
-            db.commit()
-        if current_segment is not None:
-            last_cursor["segment_index"] = current_segment + 1
-        task_repo.update_status(task_id, status="RUNNING", cursor_json=last_cursor)
-        db.commit()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+
+    last_cursor["skipped_segments"] = adapter.skipped_segments
+    await writer.call(partial(_update_cursor, task_id=task_id, lease_token=task["lease_token"], cursor=last_cursor))
+
+
+async def _produce_batches(
+    adapter: PlatformAdapter, video_id: str, cursor: dict[str, Any], queue: asyncio.Queue[DanmuBatch]
+) -> None:
+    batches = adapter.crawl_history_batches(video_id, cursor=cursor)
+    async with contextlib.aclosing(batches):
+        async for batch in batches:
+            await queue.put(batch)
 
 
-async def _commit_segment(
-    db: Session, task_repo: CrawlTaskRepository, task_id: int, cursor: dict[str, Any], inserted_count: int, seg: int
+def _read_task(task_id: int) -> dict[str, Any] | None:
+    with SessionLocal() as db:
+        return _load_task(db, task_id)
+
+
+def _load_task(db: Session, task_id: int) -> dict[str, Any] | None:
+    task = CrawlTaskRepository(db).get(task_id)
+    if task is None:
+        return None
+    return {
+        "id": task.id,
+        "platform": task.platform,
+        "video_id": task.video_id,
+        "task_type": task.task_type,
+        "cursor_json": task.cursor_json,
+    }
+
+
+def _load_crawl_state(
+    db: Session, platform: str, video_id: str, load_hashes: bool, load_pages: bool
+) -> tuple[set[int], dict[tuple[int, int], str], list[dict[str, Any]] | None]:
+    seen_keys = RawDanmuRepository(db).load_dedup_keys(platform, video_id)
+    known_hashes = SegmentFingerprintRepository(db).load_hashes(platform, video_id) if load_hashes else {}
+    cached_pages = None
+    if load_pages:
+        cached_pages = VideoRepository(db).get_cached_pages(platform, video_id, settings.crawl_meta_ttl_sec)
+    db.commit()
+    return seen_keys, known_hashes, cached_pages
+
+
+def _store_pages(db: Session, platform: str, video_id: str, pages: list[dict[str, Any]]) -> None:
+    VideoRepository(db).put_pages(platform, video_id, pages)
+    db.commit()
+
+
+def _write_batch(
+    db: Session, task_id: int, lease_token: str, video_id: str, batch: DanmuBatch, seen_keys: set[int], cursor: dict[str, Any]
 ) -> None:
+    inserted = RawDanmuRepository(db).insert_many(_rows_from_batch(batch, video_id, seen_keys))
+    _record_rows(batch, inserted, "history")
+    if batch.segment_index is None:
+        db.commit()
+        return
+    if batch.cid is not None and batch.payload_hash is not None:
+        SegmentFingerprintRepository(db).upsert(
+            batch.platform,
+            video_id,
+            batch.cid,
+            batch.segment_index,
+            payload_hash=batch.payload_hash,
+            elem_count=len(batch),
+        )
+    _commit_segment(db, task_id, lease_token, cursor, inserted)
+
+
+def _record_rows(batch: DanmuBatch, inserted: int, task_type: str) -> None:
+    metrics.crawl_rows_inserted.inc(inserted, platform=batch.platform, task_type=task_type)
+    metrics.crawl_rows_duplicate.inc(len(batch) - inserted, platform=batch.platform, task_type=task_type)
+
+
+def _seconds_between(start: datetime, end: datetime) -> float:
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    return max(0.0, (end - start).total_seconds())
+
+
+def _update_cursor(db: Session, task_id: int, lease_token: str, cursor: dict[str, Any]) -> None:
+    if not CrawlTaskRepository(db).update_status(task_id, status="RUNNING", cursor_json=cursor, lease_token=lease_token):
+        db.rollback()
+        raise LeaseLostError(f"任务租约已失效: {task_id}")
     db.commit()
+
+
+async def _run_live_task(writer: DbWriter, task: dict[str, Any], adapter: PlatformAdapter, video_id: str) -> None:
+    cursor: dict[str, Any] = dict(task["cursor_json"] or {})
+    seen_keys = await writer.call(lambda db: RawDanmuRepository(db).load_dedup_keys(task["platform"], video_id))
+    queue: asyncio.Queue[DanmuEvent] = asyncio.Queue(maxsize=settings.live_queue_maxsize)
+    max_duration_sec = float(cursor.get("max_duration_sec") or settings.live_max_duration_sec)
+    producer = asyncio.create_task(_produce_live(adapter, video_id, queue, max_duration_sec))
+    received = int(cursor.get("live_received") or 0)
+    inserted_total = int(cursor.get("live_inserted") or 0)
+    try:
+        while not (producer.done() and queue.empty()):
+            events = await _drain_live_batch(queue, settings.live_batch_max, settings.live_flush_interval_sec)
+            if not events:
+                continue
+            batch = DanmuBatch(platform=adapter.platform, video_id=video_id)
+            for event in events:
+                batch.append_event(event)
+            received += len(events)
+            new_cursor = dict(cursor)
+            new_cursor["live_received"] = received
+            new_cursor["queue_depth"] = queue.qsize()
+            new_cursor["last_commit_at"] = datetime.utcnow().isoformat()
+            inserted_total += await writer.call(
+                partial(
+                    _write_live_batch,
+                    task_id=task["id"],
+                    lease_token=task["lease_token"],
+                    video_id=video_id,
+                    batch=batch,
+                    seen_keys=seen_keys,
+                    cursor=new_cursor,
+                    inserted_total=inserted_total,
+                )
+            )
+        producer.result()
+    finally:
+        if not producer.done():
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+
+
+def _write_live_batch(
+    db: Session,
+    task_id: int,
+    lease_token: str,
+    video_id: str,
+    batch: DanmuBatch,
+    seen_keys: set[int],
+    cursor: dict[str, Any],
+    inserted_total: int,
+) -> int:
+    inserted = RawDanmuRepository(db).insert_many(_rows_from_batch(batch, video_id, seen_keys))
+    _record_rows(batch, inserted, "live")
+    cursor["live_inserted"] = inserted_total + inserted
+    _update_cursor(db, task_id, lease_token, cursor)
+    return inserted
+
+
+async def _produce_live(adapter: PlatformAdapter, video_id: str, queue: asyncio.Queue[DanmuEvent], max_duration_sec: float) -> None:
+    events = adapter.crawl_live(video_id)
+    async with contextlib.aclosing(events):
+        try:
+            async with asyncio.timeout(max_duration_sec) as duration_cap:
+                async for event in events:
+                    await queue.put(event)
+        except TimeoutError:
+            if not duration_cap.expired():
+                raise
+
+
+async def _drain_live_batch(queue: asyncio.Queue[DanmuEvent], max_items: int, flush_interval_sec: float) -> list[DanmuEvent]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + flush_interval_sec
+    events: list[DanmuEvent] = []
+    while len(events) < max_items:
+        try:
+            events.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            events.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return events
+
+
+def _rows_from_batch(batch: DanmuBatch, video_id: str, seen_keys: set[int]) -> list[dict[str, Any]]:
+    if batch.extras is not None:
+        return _rows_from_columns(batch, video_id, seen_keys)
+    platform = batch.platform
+    user_levels = batch.user_levels or [None] * len(batch)
+    like_counts = batch.like_counts or [None] * len(batch)
+    rows: list[dict[str, Any]] = []
+    for content, video_ts, send_time, user_id, raw_payload, user_level, like_count in zip(
+        batch.contents, batch.video_ts, batch.send_times, batch.user_ids, batch.raw_payloads, user_levels, like_counts
+    ):
+        user_id_h = user_hash(platform, user_id)
+        row = split_raw_payload(raw_payload)
+        cid = batch.cid if batch.cid is not None else row["cid"]
+        key = dedup_key(platform, video_id, content, video_ts, user_id_h, cid)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        row.update(
+            {
+                "platform": platform,
+                "video_id": video_id,
+                "page": batch.page if batch.page is not None else row["page"],
+                "cid": cid,
+                "content": content,
+                "video_ts": video_ts,
+                "send_time": send_time,
+                "user_id_hash": user_id_h,
+                "user_level": user_level,
+                "like_count": like_count,
+                "dedup_key": key,
+            }
+        )
+        rows.append(row)
+    return rows
+
+
+def _rows_from_columns(batch: DanmuBatch, video_id: str, seen_keys: set[int]) -> list[dict[str, Any]]:
+    platform = batch.platform
+    page = batch.page
+    cid = batch.cid
+    segment_index = batch.segment_index
+    missing = [None] * len(batch)
+    rows: list[dict[str, Any]] = []
+    for content, video_ts, send_time, user_id, extra, mode, pool, color, fontsize, weight, user_level, like_count in zip(
+        batch.contents,
+        batch.video_ts,
+        batch.send_times,
+        batch.user_ids,
+        batch.extras,
+        batch.modes or missing,
+        batch.pools or missing,
+        batch.colors or missing,
+        batch.fontsizes or missing,
+        batch.weights or missing,
+        batch.user_levels or missing,
+        batch.like_counts or missing,
+    ):
+        user_id_h = user_hash(platform, user_id)
+        key = dedup_key(platform, video_id, content, video_ts, user_id_h, cid)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        rows.append(
+            {
+                "platform": platform,
+                "video_id": video_id,
+                "page": page,
+                "cid": cid,
+                "segment_index": segment_index,
+                "mode": mode,
+                "pool": pool,
+                "color": color,
+                "fontsize": fontsize,
+                "weight": weight,
+                "content": content,
+                "video_ts": video_ts,
+                "send_time": send_time,
+                "user_id_hash": user_id_h,
+                "user_level": user_level,
+                "like_count": like_count,
+                "dedup_key": key,
+                "raw_extra": encode_extra(extra) if extra else None,
+                "raw_json": None,
+            }
+        )
+    return rows
+
+
+def _commit_segment(db: Session, task_id: int, lease_token: str, cursor: dict[str, Any], inserted_count: int) -> None:
     new_cursor = dict(cursor)
-    new_cursor["segment_index"] = seg + 1
     new_cursor["last_commit_at"] = datetime.utcnow().isoformat()
     new_cursor["inserted_in_segment"] = inserted_count
-    task_repo.update_status(task_id, status="RUNNING", cursor_json=new_cursor)
-    db.commit()
+    _update_cursor(db, task_id, lease_token, new_cursor)
 
 
-def _cursor_from_event(cursor: dict[str, Any], raw_payload: dict[str, Any]) -> dict[str, Any]:
+def _advance_cursor(cursor: dict[str, Any], batch: DanmuBatch) -> dict[str, Any]:
     next_cursor = dict(cursor)
-    for key in ("cid", "duration"):
-        if key in raw_payload:
-            next_cursor[key] = raw_payload.get(key)
+    next_segment = batch.segment_index + 1
+    pages = next_cursor.get("pages")
+    if pages and batch.cid is not None:
+        next_cursor["pages"] = [
+            {**page, "segment_index": next_segment} if int(page["cid"]) == batch.cid else page for page in pages
+        ]
+        return next_cursor
+    if batch.cid is not None:
+        next_cursor["cid"] = batch.cid
+    if batch.duration is not None:
+        next_cursor["duration"] = batch.duration
+    next_cursor["segment_index"] = next_segment
     return next_cursor
 
 
-async def run_forever(poll_interval_sec: float = 2.0) -> None:
+async def run_forever(poll_interval_sec: float | None = None, workers: int | None = None) -> None:
+    poll_interval_sec = poll_interval_sec or settings.scheduler_poll_interval_sec
+    try:
+        await asyncio.gather(*(_worker_loop(poll_interval_sec) for _ in range(workers or settings.crawl_worker_count)))
+    finally:
+        await task_notifier.close()
+        await http_pool.close()
+
+
+async def _worker_loop(poll_interval_sec: float) -> None:
     while True:
-        processed = await run_pending_tasks_once()
+        generation = task_notifier.generation
+        processed = await run_pending_tasks_once(limit=1)
         if processed == 0:
-            await asyncio.sleep(poll_interval_sec)
+            await task_notifier.wait(generation, timeout=poll_interval_sec)
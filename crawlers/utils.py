@@ -1,19 +1,26 @@
 from __future__ import annotations
 
 import hashlib
+from functools import lru_cache
 
 
 def sha256_hex(value: str) -> str:
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
 
 
+@lru_cache(maxsize=65536)
 def user_hash(platform: str, user_id: str | None) -> str | None:
     if not user_id:
         return None
     return sha256_hex(f"{platform}:{user_id}")
 
 
-def dedup_hash(platform: str, video_id: str, content: str, video_ts: float, user_id_hash: str | None) -> str:
+def dedup_key(
+    platform: str, video_id: str, content: str, video_ts: float, user_id_hash: str | None, cid: int | None = None
+) -> int:
     user_part = user_id_hash or ""
-    return sha256_hex(f"{platform}|{video_id}|{video_ts:.3f}|{user_part}|{content}")
-
+    key = f"{platform}|{video_id}|{video_ts:.3f}|{user_part}|{content}"
+    if cid is not None:
+        key += f"|{cid}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
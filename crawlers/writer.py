@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypeVar
+
+from sqlalchemy.orm import Session
+
+from database.session import SessionLocal
+
+
+T = TypeVar("T")
+
+
+class DbWriter:
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, name: str = "crawl-writer") -> None:
+        self._session_factory = session_factory
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._db: Session | None = None
+
+    async def call(self, fn: Callable[[Session], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, fn)
+
+    async def close(self) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def _run(self, fn: Callable[[Session], T]) -> T:
+        if self._db is None:
+            self._db = self._session_factory()
+        try:
+            return fn(self._db)
+        except BaseException:
+            self._db.rollback()
+            raise
+
+    def _close(self) -> None:
+        db, self._db = self._db, None
+        if db is not None:
+            db.close()
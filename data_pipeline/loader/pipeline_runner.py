@@ -1,21 +1,27 @@
 from __future__ import annotations
 
 import logging
+import time
 from datetime import datetime, timezone
 from typing import Any
 
 from sqlalchemy import delete, select
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 
+from config.settings import settings
 from data_pipeline.cleaner.spam_filter import is_spam
 from data_pipeline.cleaner.text_cleaner import is_empty_or_noise, normalize_text
+from data_pipeline.loader.snapshot import SnapshotWriter, remove_snapshots, snapshot_available, snapshot_path
 from data_pipeline.transformer.sentiment import score_sentiment
 from data_pipeline.transformer.tokenizer import tokenize
 from database.models import CleanDanmu, PipelineRun, RawDanmu
+from monitoring import metrics
 
 
 logger = logging.getLogger(__name__)
 
+STAGES = ("read", "clean", "tokenize", "sentiment", "write")
+
 
 def run_pipeline(db: Session, platform: str, video_id: str, config_json: dict[str, Any] | None = None) -> PipelineRun:
     run = PipelineRun(platform=platform, video_id=video_id, status="RUNNING", config_json=config_json)
@@ -24,50 +30,115 @@ def run_pipeline(db: Session, platform: str, video_id: str, config_json: dict[st
 
     db.execute(delete(CleanDanmu).where(CleanDanmu.platform == platform, CleanDanmu.video_id == video_id))
     db.commit()
+    previous_runs = select(PipelineRun.id).where(
+        PipelineRun.platform == platform, PipelineRun.video_id == video_id, PipelineRun.id != run.id
+    )
+    remove_snapshots(db.execute(previous_runs).scalars())
+    snapshot = _open_snapshot(run.id, platform, video_id)
 
-    stmt = select(RawDanmu).where(RawDanmu.platform == platform, RawDanmu.video_id == video_id).order_by(RawDanmu.id.asc())
+    stmt = (
+        select(RawDanmu)
+        .options(defer(RawDanmu.raw_extra))
+        .where(RawDanmu.platform == platform, RawDanmu.video_id == video_id)
+        .order_by(RawDanmu.id.asc())
+    )
+    stage_seconds = dict.fromkeys(STAGES, 0.0)
+    stage_rows = dict.fromkeys(STAGES, 0)
+    perf_counter = time.perf_counter
+    t0 = perf_counter()
     result = db.execute(stmt).scalars()
+    stage_seconds["read"] += perf_counter() - t0
 
     inserted = 0
     skipped = 0
-    for raw in result:
-        content_norm = normalize_text(raw.content)
-        if is_empty_or_noise(content_norm) or is_spam(content_norm):
-            skipped += 1
-            continue
-        tokens = tokenize(content_norm)
-        sentiment_label, sentiment_score = score_sentiment(tokens)
-        danmu_type = _map_bilibili_danmu_type(platform, raw.raw_json)
-        clean = CleanDanmu(
-            raw_id=raw.id,
-            platform=platform,
-            video_id=video_id,
-            content_norm=content_norm,
-            tokens_json=tokens,
-            sentiment_label=sentiment_label,
-            sentiment_score=sentiment_score,
-            danmu_type=danmu_type,
-            pipeline_run_id=run.id,
-        )
-        db.add(clean)
-        inserted += 1
-        if inserted % 2000 == 0:
-            db.commit()
-            logger.info("pipeline %s inserted=%s skipped=%s", run.id, inserted, skipped)
+    try:
+        while True:
+            t0 = perf_counter()
+            raw = next(result, None)
+            t1 = perf_counter()
+            stage_seconds["read"] += t1 - t0
+            if raw is None:
+                break
+            stage_rows["read"] += 1
+            content_norm = normalize_text(raw.content)
+            noise = is_empty_or_noise(content_norm) or is_spam(content_norm)
+            t2 = perf_counter()
+            stage_seconds["clean"] += t2 - t1
+            stage_rows["clean"] += 1
+            if noise:
+                skipped += 1
+                continue
+            tokens = tokenize(content_norm)
+            t3 = perf_counter()
+            stage_seconds["tokenize"] += t3 - t2
+            stage_rows["tokenize"] += 1
+            sentiment_label, sentiment_score = score_sentiment(tokens)
+            t4 = perf_counter()
+            stage_seconds["sentiment"] += t4 - t3
+            stage_rows["sentiment"] += 1
+            mode = raw.mode if raw.mode is not None else (raw.raw_json or {}).get("mode")
+            danmu_type = _map_bilibili_danmu_type(platform, mode)
+            clean = CleanDanmu(
+                raw_id=raw.id,
+                platform=platform,
+                video_id=video_id,
+                video_ts=raw.video_ts,
+                user_id_hash=raw.user_id_hash,
+                content_norm=content_norm,
+                tokens_json=tokens,
+                sentiment_label=sentiment_label,
+                sentiment_score=sentiment_score,
+                danmu_type=danmu_type,
+                pipeline_run_id=run.id,
+            )
+            db.add(clean)
+            if snapshot is not None:
+                snapshot.append(raw.id, raw.video_ts, raw.user_id_hash, content_norm, sentiment_label, danmu_type, tokens)
+            inserted += 1
+            stage_rows["write"] += 1
+            if inserted % 2000 == 0:
+                db.commit()
+                logger.info("pipeline %s inserted=%s skipped=%s", run.id, inserted, skipped)
+            stage_seconds["write"] += perf_counter() - t4
+        t0 = perf_counter()
+        db.commit()
+        stage_seconds["write"] += perf_counter() - t0
+        if snapshot is not None:
+            snapshot.close()
+    except BaseException:
+        if snapshot is not None:
+            snapshot.abort()
+        raise
 
-    db.commit()
     run.status = "SUCCEEDED"
     run.finished_at = datetime.now(tz=timezone.utc)
     db.add(run)
     db.commit()
+    _record_stage_metrics(stage_rows, stage_seconds)
     logger.info("pipeline done %s inserted=%s skipped=%s", run.id, inserted, skipped)
     return run
 
 
-def _map_bilibili_danmu_type(platform: str, raw_json: dict[str, Any]) -> str | None:
+def _open_snapshot(pipeline_run_id: int, platform: str, video_id: str) -> SnapshotWriter | None:
+    if not settings.pipeline_snapshot_enabled:
+        return None
+    if not snapshot_available():
+        logger.warning("PIPELINE_SNAPSHOT_ENABLED is set but pyarrow is not installed, skipping snapshot")
+        return None
+    return SnapshotWriter(snapshot_path(pipeline_run_id), pipeline_run_id, platform, video_id)
+
+
+def _record_stage_metrics(stage_rows: dict[str, int], stage_seconds: dict[str, float]) -> None:
+    for stage in STAGES:
+        metrics.pipeline_rows.inc(stage_rows[stage], stage=stage)
+        metrics.pipeline_stage_seconds.inc(stage_seconds[stage], stage=stage)
+        if stage_seconds[stage] > 0:
+            metrics.pipeline_rows_per_second.set(stage_rows[stage] / stage_seconds[stage], stage=stage)
+
+
+def _map_bilibili_danmu_type(platform: str, mode: int | None) -> str | None:
     if platform != "bilibili":
         return None
-    mode = raw_json.get("mode")
     if mode == 1:
         return "scroll"
     if mode == 4:
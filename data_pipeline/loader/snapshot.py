@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+from config.settings import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import ipc
+except ImportError:
+    pa = None
+    pc = None
+    ipc = None
+
+
+logger = logging.getLogger(__name__)
+
+
+COLUMNS = ("raw_id", "video_ts", "user_id_hash", "content_norm", "sentiment_label", "danmu_type", "tokens")
+
+
+def snapshot_available() -> bool:
+    return pa is not None
+
+
+def snapshot_path(pipeline_run_id: int, root: Path | None = None) -> Path:
+    return (root or settings.pipeline_snapshot_dir) / f"run_{int(pipeline_run_id)}.arrow"
+
+
+def _schema(metadata: dict[str, str] | None = None) -> Any:
+    return pa.schema(
+        [
+            ("raw_id", pa.int64()),
+            ("video_ts", pa.float64()),
+            ("user_id_hash", pa.string()),
+            ("content_norm", pa.string()),
+            ("sentiment_label", pa.string()),
+            ("danmu_type", pa.string()),
+            ("tokens", pa.list_(pa.string())),
+        ],
+        metadata=metadata,
+    )
+
+
+def _run_metadata(pipeline_run_id: int, platform: str, video_id: str) -> dict[str, str]:
+    return {"pipeline_run_id": str(int(pipeline_run_id)), "platform": platform, "video_id": video_id}
+
+
+class SnapshotWriter:
+    def __init__(self, path: Path, pipeline_run_id: int, platform: str, video_id: str, batch_rows: int = 8192) -> None:
+        if pa is None:
+            raise RuntimeError("写入快照需要安装 pyarrow")
+        self._path = path
+        self._tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        self._batch_rows = batch_rows
+        self._schema = _schema(_run_metadata(pipeline_run_id, platform, video_id))
+        self._columns: dict[str, list[Any]] = {name: [] for name in COLUMNS}
+        self._rows = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._sink = pa.OSFile(str(self._tmp), "wb")
+        self._writer = ipc.new_file(self._sink, self._schema)
+
+    def append(
+        self,
+        raw_id: int,
+        video_ts: float | None,
+        user_id_hash: str | None,
+        content_norm: str,
+        sentiment_label: str | None,
+        danmu_type: str | None,
+        tokens: list[str] | None,
+    ) -> None:
+        columns = self._columns
+        columns["raw_id"].append(raw_id)
+        columns["video_ts"].append(video_ts)
+        columns["user_id_hash"].append(user_id_hash)
+        columns["content_norm"].append(content_norm)
+        columns["sentiment_label"].append(sentiment_label)
+        columns["danmu_type"].append(danmu_type)
+        columns["tokens"].append(tokens)
+        self._rows += 1
+        if len(columns["raw_id"]) >= self._batch_rows:
+            self._flush()
+
+    def close(self) -> Path:
+        self._flush()
+        self._writer.close()
+        self._sink.close()
+        os.replace(self._tmp, self._path)
+        return self._path
+
+    def abort(self) -> None:
+        for closeable in (self._writer, self._sink):
+            with contextlib.suppress(Exception):
+                closeable.close()
+        self._tmp.unlink(missing_ok=True)
+
+    def _flush(self) -> None:
+        if not self._columns["raw_id"]:
+            return
+        self._writer.write_batch(pa.record_batch([self._columns[name] for name in COLUMNS], schema=self._schema))
+        self._columns = {name: [] for name in COLUMNS}
+
+
+def load_snapshot(
+    pipeline_run_id: int, platform: str, video_id: str, expected_rows: int, root: Path | None = None
+) -> Any | None:
+    if pa is None or not settings.pipeline_snapshot_enabled:
+        return None
+    path = snapshot_path(pipeline_run_id, root)
+    if not path.exists():
+        return None
+    table = ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+    metadata = {k.decode("utf-8"): v.decode("utf-8") for k, v in (table.schema.metadata or {}).items()}
+    if metadata != _run_metadata(pipeline_run_id, platform, video_id) or table.num_rows != expected_rows:
+        logger.warning(
+            "snapshot %s does not match pipeline_run %s (%s rows=%s, expected %s/%s rows=%s), ignoring",
+            path,
+            pipeline_run_id,
+            metadata,
+            table.num_rows,
+            platform,
+            video_id,
+            expected_rows,
+        )
+        return None
+    return table
+
+
+def snapshot_rows(snapshot: Any, *columns: str, sort_by: str | None = None) -> Iterator[tuple[Any, ...]]:
+    if sort_by is not None:
+        snapshot = snapshot.sort_by(sort_by)
+    return zip(*(snapshot.column(name).to_pylist() for name in columns))
+
+
+def bucket_counts(snapshot: Any, bucket_sec: int, mask: Any | None = None) -> dict[int, int]:
+    video_ts = snapshot.column("video_ts")
+    keep = pc.is_valid(video_ts)
+    if mask is not None:
+        keep = pc.and_kleene(keep, pc.fill_null(mask, False))
+    buckets = pc.multiply(pc.floor(pc.divide(pc.filter(video_ts, keep), float(bucket_sec))), float(bucket_sec))
+    return {int(item["values"].as_py()): int(item["counts"].as_py()) for item in pc.value_counts(buckets)}
+
+
+def token_counts(snapshot: Any) -> list[tuple[str, int]]:
+    tokens = pc.list_flatten(snapshot.column("tokens"))
+    return [(item["values"].as_py(), int(item["counts"].as_py())) for item in pc.value_counts(tokens)]
+
+
+def remove_snapshots(pipeline_run_ids: Iterable[int], root: Path | None = None) -> int:
+    removed = 0
+    for run_id in pipeline_run_ids:
+        path = snapshot_path(run_id, root)
+        if path.exists():
+            path.unlink()
+            removed += 1
+    return removed
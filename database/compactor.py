@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from config.settings import Settings, settings
+from data_pipeline.loader.snapshot import remove_snapshots
+from database.models import CleanDanmu, MetricsSummary, MetricsTimeSeries
+from database.repositories.pipeline_run_repo import PipelineRunRepository
+from database.session import SessionLocal, engine
+from database.sharding import shard_router, shard_session
+from monitoring import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_VACUUM_MAX_ROUNDS = 20
+
+
+@dataclass(frozen=True, slots=True)
+class RetentionPolicy:
+    keep_runs: int = 3
+    keep_days: float = 0.0
+    batch_size: int = 500
+    vacuum_pages: int = 1000
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> RetentionPolicy:
+        return cls(
+            keep_runs=settings.retention_keep_runs,
+            keep_days=settings.retention_keep_days,
+            batch_size=settings.retention_batch_size,
+            vacuum_pages=settings.retention_vacuum_pages,
+        )
+
+
+def compact(
+    policy: RetentionPolicy,
+    session_factory: Callable[[], Session] = SessionLocal,
+    video_session: Callable[[str, str], Session] = shard_session,
+    engines: list[Engine] | None = None,
+) -> dict[str, Any]:
+    engines = engines if engines is not None else _engines()
+    before = {e.url.database: _sqlite_size(e) for e in engines}
+    rows_deleted = dict.fromkeys(("clean_danmu", "metrics_time_series", "metrics_summary", "pipeline_run"), 0)
+
+    with session_factory() as db:
+        runs = PipelineRunRepository(db).list_stale(policy.keep_runs, policy.keep_days)
+        stale = [(run.id, run.platform, run.video_id) for run in runs]
+        for run_id, platform, video_id in stale:
+            with video_session(platform, video_id) as video_db:
+                rows_deleted["clean_danmu"] += _delete_in_batches(video_db, CleanDanmu, run_id, policy.batch_size)
+            rows_deleted["metrics_time_series"] += _delete_in_batches(db, MetricsTimeSeries, run_id, policy.batch_size)
+            rows_deleted["metrics_summary"] += _delete_in_batches(db, MetricsSummary, run_id, policy.batch_size)
+            PipelineRunRepository(db).delete(run_id)
+            db.commit()
+            rows_deleted["pipeline_run"] += 1
+    snapshots_removed = remove_snapshots(run_id for run_id, _, _ in stale)
+
+    databases = []
+    for e in engines:
+        _incremental_vacuum(e, policy.vacuum_pages)
+        after = _sqlite_size(e)
+        reclaimed = max(0, before[e.url.database]["bytes"] - after["bytes"]) if after else 0
+        if after:
+            databases.append({"database": e.url.database, **after, "reclaimed_bytes": reclaimed})
+        metrics.retention_bytes_reclaimed.inc(reclaimed)
+    for table, count in rows_deleted.items():
+        metrics.retention_rows_deleted.inc(count, table=table)
+    return {"runs_deleted": len(stale), "rows_deleted": rows_deleted, "snapshots_removed": snapshots_removed, "databases": databases}
+
+
+async def compactor_loop(policy: RetentionPolicy, interval_sec: float) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            report = await asyncio.to_thread(compact, policy)
+            logger.info("retention compaction %s", report)
+        except Exception:
+            logger.exception("retention compaction failed")
+
+
+def _engines() -> list[Engine]:
+    return [engine, *(shard_router.engines() if shard_router is not None else [])]
+
+
+def _delete_in_batches(db: Session, model: Any, pipeline_run_id: int, batch_size: int) -> int:
+    repo = PipelineRunRepository(db)
+    total = 0
+    while True:
+        deleted = repo.delete_rows(model, pipeline_run_id, batch_size)
+        db.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def _sqlite_size(engine: Engine) -> dict[str, int]:
+    if engine.dialect.name != "sqlite":
+        return {}
+    with engine.connect() as conn:
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        freelist = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return {"bytes": page_size * page_count, "freelist_pages": freelist}
+
+
+def _incremental_vacuum(engine: Engine, pages: int) -> None:
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            if conn.exec_driver_sql("PRAGMA freelist_count").scalar():
+                logger.info("%s is not in auto_vacuum=INCREMENTAL mode, run VACUUM once to reclaim free pages", engine.url.database)
+            return
+        remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        for _ in range(_VACUUM_MAX_ROUNDS):
+            if not remaining:
+                return
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            previous, remaining = remaining, conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= previous:
+                return
+
+
+if __name__ == "__main__":
+    print(json.dumps(compact(RetentionPolicy.from_settings(settings)), ensure_ascii=False, indent=2))
@@ -1,17 +1,17 @@
 from __future__ import annotations
 
-from sqlalchemy import create_engine
-
 from config.settings import settings
+from database.migrations import upgrade_schema
 from database.models import Base
+from database.session import engine
+from database.sharding import shard_router
 
 
 def init_db() -> None:
     settings.data_dir.mkdir(parents=True, exist_ok=True)
     settings.cache_dir.mkdir(parents=True, exist_ok=True)
-    connect_args: dict[str, object] = {}
-    if settings.database_url.startswith("sqlite:"):
-        connect_args = {"check_same_thread": False}
-    engine = create_engine(settings.database_url, future=True, pool_pre_ping=True, connect_args=connect_args)
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    if shard_router is not None:
+        shard_router.engines()
 
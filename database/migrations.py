@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import json
+import logging
+from collections.abc import Callable
+from typing import Any
+
+from sqlalchemy import BigInteger, Column, MetaData, Table, bindparam, inspect, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, DropConstraint, UniqueConstraint
+from sqlalchemy.sql.elements import TextClause
+
+from crawlers.utils import dedup_key
+from database.models import ACTIVE_TASK_CONDITION, Base, CleanDanmu, CrawlTask, RawDanmu
+from database.raw_payload import TYPED_FIELDS, split_raw_payload
+
+
+logger = logging.getLogger(__name__)
+
+
+_COPY_CHUNK_SIZE = 5000
+
+
+_OBSOLETE_INDEXES = {"clean_danmu": ("ix_clean_danmu_platform_video_ts",)}
+
+
+def upgrade_schema(engine: Engine) -> None:
+    _migrate_raw_danmu_dedup_key(engine)
+    _migrate_clean_danmu_denormalized(engine)
+    _add_missing_columns(engine)
+    _migrate_raw_danmu_payload(engine)
+    _migrate_raw_danmu_cid_dedup_key(engine)
+    _drop_obsolete_indexes(engine)
+    _dedupe_active_crawl_tasks(engine)
+    _create_missing_indexes(engine)
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                default = _literal_server_default(column)
+                if default is not None:
+                    ddl += f" NOT NULL DEFAULT {default}"
+                conn.execute(text(ddl))
+                logger.info("schema upgrade: added column %s.%s", table.name, column.name)
+
+
+def _create_missing_indexes(engine: Engine) -> None:
+    existing_tables = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+
+def _dedupe_active_crawl_tasks(engine: Engine) -> None:
+    if engine.dialect.name not in ("sqlite", "postgresql"):
+        return
+    inspector = inspect(engine)
+    if "crawl_task" not in inspector.get_table_names():
+        return
+    if "uq_crawl_task_active" in {index["name"] for index in inspector.get_indexes("crawl_task")}:
+        return
+    table = CrawlTask.__table__
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(table.c.id, table.c.platform, table.c.video_id, table.c.task_type)
+            .where(text(ACTIVE_TASK_CONDITION))
+            .order_by((table.c.status == "RUNNING").desc(), table.c.id)
+        ).all()
+        kept: set[tuple[str, str, str]] = set()
+        duplicates: list[int] = []
+        for task_id, *key in rows:
+            if tuple(key) in kept:
+                duplicates.append(task_id)
+            else:
+                kept.add(tuple(key))
+        if not duplicates:
+            return
+        logger.info("schema upgrade: closing %d duplicate active crawl tasks", len(duplicates))
+        for i in range(0, len(duplicates), _COPY_CHUNK_SIZE):
+            conn.execute(
+                update(table)
+                .where(table.c.id.in_(duplicates[i : i + _COPY_CHUNK_SIZE]))
+                .values(status="FAILED", worker_id=None, lease_expires_at=None, last_error="重复的进行中任务，已合并")
+            )
+
+
+def _drop_obsolete_indexes(engine: Engine) -> None:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table_name, index_names in _OBSOLETE_INDEXES.items():
+            if table_name not in existing_tables:
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table_name)}
+            if not existing.intersection(index_names):
+                continue
+            table = Table(table_name, MetaData(), autoload_with=conn)
+            for index in list(table.indexes):
+                if index.name in index_names:
+                    index.drop(bind=conn)
+                    logger.info("schema upgrade: dropped index %s", index.name)
+
+
+def _literal_server_default(column: Column) -> str | None:
+    server_default = column.server_default
+    arg = getattr(server_default, "arg", None)
+    if isinstance(arg, TextClause):
+        return arg.text
+    if isinstance(arg, str):
+        return "'" + arg.replace("'", "''") + "'"
+    return None
+
+
+def _migrate_raw_danmu_dedup_key(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if "raw_danmu" not in inspector.get_table_names():
+        return
+    columns = {c["name"] for c in inspector.get_columns("raw_danmu")}
+    if "dedup_hash" not in columns:
+        return
+    logger.info("schema upgrade: raw_danmu.dedup_hash -> dedup_key")
+
+    def with_dedup_key(row: dict[str, Any]) -> dict[str, Any]:
+        row["dedup_key"] = _row_dedup_key(row)
+        return row
+
+    if engine.dialect.name == "sqlite":
+        _rebuild_sqlite_table(engine, RawDanmu.__table__, lambda row: with_dedup_key(_with_typed_payload(row)))
+        return
+
+    table = RawDanmu.__table__
+    with engine.begin() as conn:
+        if "dedup_key" not in columns:
+            conn.execute(text("ALTER TABLE raw_danmu ADD COLUMN dedup_key BIGINT"))
+        legacy = Table("raw_danmu", MetaData(), autoload_with=conn)
+        stmt = update(legacy).where(legacy.c.id == bindparam("b_id")).values(dedup_key=bindparam("b_key"))
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(legacy).where(legacy.c.id > last_id, legacy.c.dedup_key.is_(None)).order_by(legacy.c.id).limit(_COPY_CHUNK_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            conn.execute(stmt, [{"b_id": r["id"], "b_key": with_dedup_key(dict(r))["dedup_key"]} for r in rows])
+            last_id = rows[-1]["id"]
+        conn.execute(DropConstraint(UniqueConstraint(name="uq_raw_danmu_dedup", table=legacy)))
+        conn.execute(text("ALTER TABLE raw_danmu DROP COLUMN dedup_hash"))
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE raw_danmu ALTER COLUMN dedup_key SET NOT NULL"))
+        else:
+            conn.execute(text(f"ALTER TABLE raw_danmu MODIFY dedup_key {BigInteger().compile(dialect=engine.dialect)} NOT NULL"))
+        conn.execute(AddConstraint(next(c for c in table.constraints if c.name == "uq_raw_danmu_dedup")))
+
+
+def _migrate_raw_danmu_cid_dedup_key(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if "raw_danmu" not in inspector.get_table_names():
+        return
+    if "cid" not in {c["name"] for c in inspector.get_columns("raw_danmu")}:
+        return
+    table = RawDanmu.__table__
+    key_columns = [table.c[name] for name in ("id", "platform", "video_id", "content", "video_ts", "user_id_hash", "cid")]
+    with engine.begin() as conn:
+        sample = conn.execute(
+            select(*key_columns, table.c.dedup_key).where(table.c.cid.is_not(None)).order_by(table.c.id).limit(1)
+        ).mappings().first()
+        if sample is None or sample["dedup_key"] == _row_dedup_key(sample):
+            return
+        logger.info("schema upgrade: raw_danmu.dedup_key += cid")
+        stmt = update(table).where(table.c.id == bindparam("b_id")).values(dedup_key=bindparam("b_key"))
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(*key_columns)
+                .where(table.c.id > last_id, table.c.cid.is_not(None))
+                .order_by(table.c.id)
+                .limit(_COPY_CHUNK_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            conn.execute(stmt, [{"b_id": r["id"], "b_key": _row_dedup_key(r)} for r in rows])
+            last_id = rows[-1]["id"]
+
+
+def _row_dedup_key(row: Any) -> int:
+    return dedup_key(row["platform"], row["video_id"], row["content"], row["video_ts"], row["user_id_hash"], row.get("cid"))
+
+
+def _migrate_clean_danmu_denormalized(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if "clean_danmu" not in inspector.get_table_names():
+        return
+    columns = {c["name"] for c in inspector.get_columns("clean_danmu")}
+    if "video_ts" in columns and "user_id_hash" in columns:
+        return
+    logger.info("schema upgrade: clean_danmu.video_ts/user_id_hash from raw_danmu")
+    with engine.begin() as conn:
+        for name in ("video_ts", "user_id_hash"):
+            if name not in columns:
+                column = CleanDanmu.__table__.c[name]
+                conn.execute(text(f"ALTER TABLE clean_danmu ADD COLUMN {name} {column.type.compile(dialect=engine.dialect)}"))
+        low, high = conn.execute(text("SELECT MIN(id), MAX(id) FROM clean_danmu")).one()
+        if low is None:
+            return
+        stmt = text(
+            "UPDATE clean_danmu SET "
+            "video_ts = (SELECT r.video_ts FROM raw_danmu r WHERE r.id = clean_danmu.raw_id), "
+            "user_id_hash = (SELECT r.user_id_hash FROM raw_danmu r WHERE r.id = clean_danmu.raw_id) "
+            "WHERE id >= :lo AND id < :hi"
+        )
+        for start in range(low, high + 1, _COPY_CHUNK_SIZE):
+            conn.execute(stmt, {"lo": start, "hi": start + _COPY_CHUNK_SIZE})
+
+
+def _migrate_raw_danmu_payload(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if "raw_danmu" not in inspector.get_table_names():
+        return
+    raw_json = next((c for c in inspector.get_columns("raw_danmu") if c["name"] == "raw_json"), None)
+    if raw_json is None or raw_json["nullable"]:
+        return
+    logger.info("schema upgrade: raw_danmu.raw_json -> typed columns + raw_extra")
+
+    if engine.dialect.name == "sqlite":
+        _rebuild_sqlite_table(engine, RawDanmu.__table__, _with_typed_payload)
+        return
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE raw_danmu ALTER COLUMN raw_json DROP NOT NULL"))
+        else:
+            conn.execute(text("ALTER TABLE raw_danmu MODIFY raw_json JSON NULL"))
+        legacy = Table("raw_danmu", MetaData(), autoload_with=conn)
+        names = ("raw_json", "raw_extra", *TYPED_FIELDS)
+        stmt = update(legacy).where(legacy.c.id == bindparam("b_id")).values({name: bindparam(f"b_{name}") for name in names})
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(legacy.c.id, legacy.c.raw_json, legacy.c.page, legacy.c.cid)
+                .where(legacy.c.id > last_id, legacy.c.raw_json.is_not(None))
+                .order_by(legacy.c.id)
+                .limit(_COPY_CHUNK_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            params = []
+            for r in rows:
+                item = _with_typed_payload(dict(r))
+                params.append({"b_id": item["id"], **{f"b_{name}": item[name] for name in names}})
+            conn.execute(stmt, params)
+            last_id = rows[-1]["id"]
+
+
+def _with_typed_payload(row: dict[str, Any]) -> dict[str, Any]:
+    payload = row.get("raw_json")
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    if payload is None:
+        return row
+    for name, value in split_raw_payload(payload).items():
+        if name in TYPED_FIELDS and row.get(name) is not None:
+            continue
+        row[name] = value
+    return row
+
+
+def _rebuild_sqlite_table(engine: Engine, table: Table, transform: Callable[[dict[str, Any]], dict[str, Any]]) -> None:
+    legacy_name = f"{table.name}__legacy"
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {legacy_name}")
+        for index in inspect(conn).get_indexes(legacy_name):
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index['name']}")
+        table.create(conn)
+        legacy = Table(legacy_name, MetaData(), autoload_with=conn)
+        _copy_rows(conn, legacy, table, transform)
+        conn.exec_driver_sql(f"DROP TABLE {legacy_name}")
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+
+
+def _copy_rows(conn: Connection, source: Table, target: Table, transform: Callable[[dict[str, Any]], dict[str, Any]]) -> None:
+    target_columns = set(target.c.keys())
+    insert_stmt = target.insert().prefix_with("OR IGNORE")
+    last_id = 0
+    while True:
+        rows = conn.execute(select(source).where(source.c.id > last_id).order_by(source.c.id).limit(_COPY_CHUNK_SIZE)).mappings().all()
+        if not rows:
+            break
+        batch = []
+        for row in rows:
+            item = transform(dict(row))
+            batch.append({k: v for k, v in item.items() if k in target_columns})
+        conn.execute(insert_stmt, batch)
+        last_id = rows[-1]["id"]
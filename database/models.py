@@ -3,9 +3,25 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Any
 
-from sqlalchemy import JSON, DateTime, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint, func
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    UniqueConstraint,
+    func,
+    text,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+from database.raw_payload import merge_raw_payload
+
 
 class Base(DeclarativeBase):
     pass
@@ -24,6 +40,9 @@ class Video(Base):
     __table_args__ = (UniqueConstraint("platform", "video_id", name="uq_video_platform_video_id"),)
 
 
+ACTIVE_TASK_CONDITION = "status IN ('PENDING', 'RUNNING')"
+
+
 class CrawlTask(Base):
     __tablename__ = "crawl_task"
 
@@ -32,15 +51,33 @@ class CrawlTask(Base):
     video_id: Mapped[str] = mapped_column(String(128), nullable=False)
     task_type: Mapped[str] = mapped_column(String(32), nullable=False)
     status: Mapped[str] = mapped_column(String(16), nullable=False, index=True)
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    deadline_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    submitter: Mapped[str | None] = mapped_column(String(64), nullable=True)
     cursor_json: Mapped[dict[str, Any] | None] = mapped_column(JSON, nullable=True)
     retry_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    worker_id: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, index=True)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
     )
 
-    __table_args__ = (Index("ix_crawl_task_platform_video", "platform", "video_id"),)
+    __table_args__ = (
+        Index("ix_crawl_task_platform_video", "platform", "video_id"),
+        Index("ix_crawl_task_status_priority", "status", "priority", "created_at"),
+        Index(
+            "uq_crawl_task_active",
+            "platform",
+            "video_id",
+            "task_type",
+            unique=True,
+            sqlite_where=text(ACTIVE_TASK_CONDITION),
+            postgresql_where=text(ACTIVE_TASK_CONDITION),
+        ).ddl_if(dialect=("sqlite", "postgresql")),
+    )
 
 
 class RawDanmu(Base):
@@ -49,24 +86,56 @@ class RawDanmu(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     platform: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
     video_id: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    page: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    cid: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    segment_index: Mapped[int | None] = mapped_column(Integer, nullable=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     video_ts: Mapped[float] = mapped_column(Float, nullable=False, index=True)
     send_time: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     user_id_hash: Mapped[str | None] = mapped_column(String(128), nullable=True, index=True)
     user_level: Mapped[int | None] = mapped_column(Integer, nullable=True)
     like_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
-    dedup_hash: Mapped[str] = mapped_column(String(64), nullable=False)
-    raw_json: Mapped[dict[str, Any]] = mapped_column(JSON, nullable=False)
+    dedup_key: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    mode: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    pool: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    color: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    fontsize: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    weight: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    raw_extra: Mapped[bytes | None] = mapped_column(LargeBinary, nullable=True)
+    raw_json: Mapped[dict[str, Any] | None] = mapped_column(JSON(none_as_null=True), nullable=True)
     ingested_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     clean_items: Mapped[list["CleanDanmu"]] = relationship("CleanDanmu", back_populates="raw")
 
+    @property
+    def payload(self) -> dict[str, Any]:
+        return merge_raw_payload(self)
+
     __table_args__ = (
-        UniqueConstraint("platform", "video_id", "dedup_hash", name="uq_raw_danmu_dedup"),
+        UniqueConstraint("platform", "video_id", "dedup_key", name="uq_raw_danmu_dedup"),
         Index("ix_raw_danmu_platform_video_ts", "platform", "video_id", "video_ts"),
     )
 
 
+class SegmentFingerprint(Base):
+    __tablename__ = "segment_fingerprint"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    platform: Mapped[str] = mapped_column(String(32), nullable=False)
+    video_id: Mapped[str] = mapped_column(String(128), nullable=False)
+    cid: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    segment_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    payload_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    elem_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        UniqueConstraint("platform", "video_id", "cid", "segment_index", name="uq_segment_fingerprint"),
+    )
+
+
 class PipelineRun(Base):
     __tablename__ = "pipeline_run"
 
@@ -88,6 +157,8 @@ class CleanDanmu(Base):
     raw_id: Mapped[int] = mapped_column(ForeignKey("raw_danmu.id"), nullable=False, index=True)
     platform: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
     video_id: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    video_ts: Mapped[float | None] = mapped_column(Float, nullable=True)
+    user_id_hash: Mapped[str | None] = mapped_column(String(128), nullable=True)
     content_norm: Mapped[str] = mapped_column(Text, nullable=False)
     tokens_json: Mapped[list[str] | None] = mapped_column(JSON, nullable=True)
     sentiment_label: Mapped[str | None] = mapped_column(String(16), nullable=True, index=True)
@@ -98,7 +169,7 @@ class CleanDanmu(Base):
 
     raw: Mapped[RawDanmu] = relationship("RawDanmu", back_populates="clean_items")
 
-    __table_args__ = (Index("ix_clean_danmu_platform_video_ts", "platform", "video_id"),)
+    __table_args__ = (Index("ix_clean_danmu_run_video_ts", "platform", "video_id", "pipeline_run_id", "video_ts"),)
 
 
 class MetricsTimeSeries(Base):
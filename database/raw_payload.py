@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any
+
+from config.settings import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+TYPED_FIELDS = ("page", "cid", "segment_index", "mode", "pool", "color", "fontsize", "weight")
+
+FORMAT_JSON = 0
+FORMAT_JSON_ZLIB = 1
+FORMAT_MSGPACK = 2
+FORMAT_MSGPACK_ZSTD = 3
+
+EXTRA_FORMATS = ("json", "msgpack", "msgpack_zstd")
+
+COMPRESS_MIN_BYTES = 256
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def split_raw_payload(payload: dict[str, Any] | None) -> dict[str, Any]:
+    columns: dict[str, Any] = dict.fromkeys(TYPED_FIELDS)
+    extra: dict[str, Any] = {}
+    for key, value in (payload or {}).items():
+        if key in columns and _is_int(value):
+            columns[key] = value
+        elif key != "content":
+            extra[key] = value
+    columns["raw_extra"] = encode_extra(extra) if extra else None
+    columns["raw_json"] = None
+    return columns
+
+
+def encode_extra(value: dict[str, Any], fmt: str | None = None) -> bytes:
+    fmt = (fmt or settings.raw_extra_format).lower()
+    if fmt not in EXTRA_FORMATS:
+        raise ValueError(f"无效的 raw_extra 编码: {fmt}，可选 {list(EXTRA_FORMATS)}")
+    if fmt != "json":
+        if msgpack is None or (fmt == "msgpack_zstd" and zstandard is None):
+            packages = "msgpack" if fmt == "msgpack" else "msgpack 和 zstandard"
+            raise RuntimeError(f"RAW_EXTRA_FORMAT={fmt} 需要安装 {packages}")
+        plain = msgpack.packb(value, use_bin_type=True)
+        if fmt == "msgpack_zstd" and len(plain) >= COMPRESS_MIN_BYTES:
+            packed = zstandard.ZstdCompressor(level=3).compress(plain)
+            if len(packed) < len(plain):
+                return bytes([FORMAT_MSGPACK_ZSTD]) + packed
+        return bytes([FORMAT_MSGPACK]) + plain
+    plain = _json_encoder.encode(value).encode("utf-8")
+    if len(plain) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(plain, 6)
+        if len(packed) < len(plain):
+            return bytes([FORMAT_JSON_ZLIB]) + packed
+    return bytes([FORMAT_JSON]) + plain
+
+
+def decode_extra(data: bytes | None) -> dict[str, Any]:
+    if not data:
+        return {}
+    fmt, body = data[0], data[1:]
+    if fmt == FORMAT_JSON:
+        return json.loads(body.decode("utf-8"))
+    if fmt == FORMAT_JSON_ZLIB:
+        return json.loads(zlib.decompress(body).decode("utf-8"))
+    if fmt in (FORMAT_MSGPACK, FORMAT_MSGPACK_ZSTD):
+        if msgpack is None or (fmt == FORMAT_MSGPACK_ZSTD and zstandard is None):
+            raise RuntimeError("解码 raw_extra 需要安装 msgpack 和 zstandard")
+        if fmt == FORMAT_MSGPACK_ZSTD:
+            body = zstandard.ZstdDecompressor().decompress(body)
+        return msgpack.unpackb(body, raw=False)
+    raise ValueError(f"未知的 raw_extra 编码格式: {fmt}")
+
+
+def merge_raw_payload(row: Any) -> dict[str, Any]:
+    if row.raw_json is not None:
+        return dict(row.raw_json)
+    payload = decode_extra(row.raw_extra)
+    for name in TYPED_FIELDS:
+        value = getattr(row, name)
+        if value is not None:
+            payload[name] = value
+    payload["content"] = row.content
+    return payload
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and -(2**63) <= value < 2**63
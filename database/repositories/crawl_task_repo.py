@@ -1,29 +1,300 @@
 from __future__ import annotations
 
-from sqlalchemy import select, update
-from sqlalchemy.orm import Session
+import uuid
+from datetime import datetime, timedelta, timezone
 
-from database.models import CrawlTask
+from sqlalchemy import and_, func, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql.elements import ColumnElement
+from sqlalchemy.sql.selectable import ScalarSelect
+
+from database.models import ACTIVE_TASK_CONDITION, CrawlTask
+
+
+_running = aliased(CrawlTask, name="running")
 
 
 class CrawlTaskRepository:
     def __init__(self, db: Session) -> None:
         self._db = db
 
-    def create(self, platform: str, video_id: str, task_type: str, cursor_json: dict | None = None) -> CrawlTask:
-        task = CrawlTask(platform=platform, video_id=video_id, task_type=task_type, status="PENDING", cursor_json=cursor_json)
+    def create(
+        self,
+        platform: str,
+        video_id: str,
+        task_type: str,
+        cursor_json: dict | None = None,
+        priority: int = 0,
+        deadline_at: datetime | None = None,
+        submitter: str | None = None,
+    ) -> CrawlTask:
+        task = CrawlTask(
+            platform=platform,
+            video_id=video_id,
+            task_type=task_type,
+            status="PENDING",
+            cursor_json=cursor_json,
+            priority=priority,
+            deadline_at=deadline_at,
+            submitter=submitter,
+        )
         self._db.add(task)
         self._db.flush()
         return task
 
+    def find_active(self, platform: str, video_ids: list[str], task_type: str, chunk_size: int = 500) -> dict[str, CrawlTask]:
+        found: dict[str, CrawlTask] = {}
+        for i in range(0, len(video_ids), chunk_size):
+            stmt = (
+                select(CrawlTask)
+                .where(
+                    CrawlTask.platform == platform,
+                    CrawlTask.task_type == task_type,
+                    CrawlTask.status.in_(("PENDING", "RUNNING")),
+                    CrawlTask.video_id.in_(video_ids[i : i + chunk_size]),
+                )
+                .order_by(CrawlTask.created_at.asc())
+            )
+            for task in self._db.execute(stmt).scalars().all():
+                found.setdefault(task.video_id, task)
+        return found
+
+    def create_or_reuse_many(
+        self,
+        platform: str,
+        video_ids: list[str],
+        task_type: str,
+        priority: int = 0,
+        deadline_at: datetime | None = None,
+        submitter: str | None = None,
+    ) -> dict[str, tuple[CrawlTask, bool]]:
+        unique_ids = list(dict.fromkeys(video_ids))
+        active = self.find_active(platform, unique_ids, task_type)
+        missing = [video_id for video_id in unique_ids if video_id not in active]
+        created_ids: set[int] = set()
+        if missing:
+            rows = [
+                {
+                    "platform": platform,
+                    "video_id": video_id,
+                    "task_type": task_type,
+                    "status": "PENDING",
+                    "priority": priority,
+                    "deadline_at": deadline_at,
+                    "submitter": submitter,
+                }
+                for video_id in missing
+            ]
+            created_ids = self._insert_pending(rows)
+            active.update(self.find_active(platform, missing, task_type))
+        result: dict[str, tuple[CrawlTask, bool]] = {}
+        for video_id, task in active.items():
+            reused = task.id not in created_ids
+            if reused and task.status == "PENDING":
+                if priority > task.priority:
+                    task.priority = priority
+                if deadline_at is not None and (task.deadline_at is None or _as_utc(deadline_at) < _as_utc(task.deadline_at)):
+                    task.deadline_at = deadline_at
+            result[video_id] = (task, reused)
+        self._db.flush()
+        return result
+
+    def _insert_pending(self, rows: list[dict[str, object]]) -> set[int]:
+        dialect = self._db.get_bind(CrawlTask).dialect.name
+        if dialect == "sqlite":
+            stmt = sqlite.insert(CrawlTask).on_conflict_do_nothing(
+                index_elements=[CrawlTask.platform, CrawlTask.video_id, CrawlTask.task_type],
+                index_where=text(ACTIVE_TASK_CONDITION),
+            )
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(CrawlTask).on_conflict_do_nothing(
+                index_elements=[CrawlTask.platform, CrawlTask.video_id, CrawlTask.task_type],
+                index_where=text(ACTIVE_TASK_CONDITION),
+            )
+        else:
+            tasks = [CrawlTask(**row) for row in rows]
+            self._db.add_all(tasks)
+            self._db.flush()
+            return {task.id for task in tasks}
+        return set(self._db.execute(stmt.returning(CrawlTask.id), rows).scalars().all())
+
     def get(self, task_id: int) -> CrawlTask | None:
         stmt = select(CrawlTask).where(CrawlTask.id == task_id)
         return self._db.execute(stmt).scalars().first()
 
     def list_pending(self, limit: int = 10) -> list[CrawlTask]:
-        stmt = select(CrawlTask).where(CrawlTask.status == "PENDING").order_by(CrawlTask.created_at.asc()).limit(limit)
+        stmt = (
+            select(CrawlTask)
+            .where(CrawlTask.status == "PENDING")
+            .order_by(CrawlTask.priority.desc(), CrawlTask.created_at.asc())
+            .limit(limit)
+        )
         return list(self._db.execute(stmt).scalars().all())
 
+    def claim(
+        self,
+        worker_id: str,
+        limit: int,
+        lease_sec: float,
+        aging_sec: float = 600.0,
+        deadline_window_sec: float = 600.0,
+        max_running_per_platform: int = 0,
+        max_running_per_submitter: int = 0,
+        candidate_factor: int = 20,
+    ) -> list[CrawlTask]:
+        now = datetime.now(tz=timezone.utc)
+        claimable = or_(
+            CrawlTask.status == "PENDING",
+            and_(
+                CrawlTask.status == "RUNNING",
+                or_(CrawlTask.lease_expires_at.is_(None), CrawlTask.lease_expires_at < now),
+            ),
+        )
+        dialect = self._db.get_bind(CrawlTask).dialect.name
+        lock = dialect in ("postgresql", "mysql", "mariadb")
+        window = max(limit, 1) * candidate_factor
+        candidate_queries = (
+            select(CrawlTask).where(claimable).order_by(CrawlTask.priority.desc(), CrawlTask.created_at.asc()),
+            select(CrawlTask).where(claimable).order_by(CrawlTask.created_at.asc()),
+            select(CrawlTask).where(claimable, CrawlTask.deadline_at.is_not(None)).order_by(CrawlTask.deadline_at.asc()),
+        )
+        candidates: dict[int, CrawlTask] = {}
+        for stmt in candidate_queries:
+            stmt = stmt.limit(window)
+            if lock:
+                stmt = stmt.with_for_update(skip_locked=True)
+            for task in self._db.execute(stmt).scalars().all():
+                candidates[task.id] = task
+        if not candidates:
+            return []
+
+        platform_running, submitter_running = self._running_counts(now)
+        ranked = sorted(
+            candidates.values(),
+            key=lambda task: (-_effective_priority(task, now, aging_sec, deadline_window_sec), _as_utc(task.created_at), task.id),
+        )
+        claimed_ids: list[int] = []
+        for task in ranked:
+            if len(claimed_ids) >= limit:
+                break
+            if max_running_per_platform > 0 and platform_running.get(task.platform, 0) >= max_running_per_platform:
+                continue
+            if (
+                max_running_per_submitter > 0
+                and task.submitter is not None
+                and submitter_running.get(task.submitter, 0) >= max_running_per_submitter
+            ):
+                continue
+            conditions = [CrawlTask.id == task.id, claimable]
+            if dialect not in ("mysql", "mariadb"):
+                if max_running_per_platform > 0:
+                    conditions.append(_running_count(now, _running.platform == task.platform) < max_running_per_platform)
+                if max_running_per_submitter > 0 and task.submitter is not None:
+                    conditions.append(_running_count(now, _running.submitter == task.submitter) < max_running_per_submitter)
+            result = self._db.execute(
+                update(CrawlTask)
+                .where(*conditions)
+                .values(
+                    status="RUNNING",
+                    worker_id=f"{worker_id}:{uuid.uuid4().hex[:12]}",
+                    lease_expires_at=now + timedelta(seconds=lease_sec),
+                    started_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed_ids.append(task.id)
+                platform_running[task.platform] = platform_running.get(task.platform, 0) + 1
+                if task.submitter is not None:
+                    submitter_running[task.submitter] = submitter_running.get(task.submitter, 0) + 1
+        if not claimed_ids:
+            return []
+        stmt = select(CrawlTask).where(CrawlTask.id.in_(claimed_ids)).execution_options(populate_existing=True)
+        claimed = {task.id: task for task in self._db.execute(stmt).scalars().all()}
+        return [claimed[task_id] for task_id in claimed_ids if task_id in claimed]
+
+    def pending_by_priority(self) -> dict[int, int]:
+        stmt = select(CrawlTask.priority, func.count()).where(CrawlTask.status == "PENDING").group_by(CrawlTask.priority)
+        return {priority: count for priority, count in self._db.execute(stmt).all()}
+
+    def queue_stats(self, recent_limit: int = 1000) -> list[dict[str, object]]:
+        now = datetime.now(tz=timezone.utc)
+        stats: dict[int, dict[str, object]] = {}
+
+        def bucket(priority: int) -> dict[str, object]:
+            return stats.setdefault(
+                priority,
+                {"priority": priority, "pending": 0, "running": 0, "oldest_wait_sec": 0.0, "avg_wait_sec": None, "started": 0},
+            )
+
+        stmt = (
+            select(CrawlTask.priority, CrawlTask.status, func.count(), func.min(CrawlTask.created_at))
+            .where(CrawlTask.status.in_(("PENDING", "RUNNING")))
+            .group_by(CrawlTask.priority, CrawlTask.status)
+        )
+        for priority, status, count, oldest in self._db.execute(stmt).all():
+            row = bucket(priority)
+            if status == "PENDING":
+                row["pending"] = count
+                row["oldest_wait_sec"] = round(max(0.0, (now - _as_utc(oldest)).total_seconds()), 3)
+            else:
+                row["running"] = count
+
+        stmt = (
+            select(CrawlTask.priority, CrawlTask.created_at, CrawlTask.started_at)
+            .where(CrawlTask.started_at.is_not(None))
+            .order_by(CrawlTask.started_at.desc())
+            .limit(recent_limit)
+        )
+        waits: dict[int, list[float]] = {}
+        for priority, created_at, started_at in self._db.execute(stmt).all():
+            waits.setdefault(priority, []).append(max(0.0, (_as_utc(started_at) - _as_utc(created_at)).total_seconds()))
+        for priority, values in waits.items():
+            row = bucket(priority)
+            row["started"] = len(values)
+            row["avg_wait_sec"] = round(sum(values) / len(values), 3)
+        return [stats[priority] for priority in sorted(stats, reverse=True)]
+
+    def _running_counts(self, now: datetime) -> tuple[dict[str, int], dict[str, int]]:
+        running = and_(CrawlTask.status == "RUNNING", CrawlTask.lease_expires_at >= now)
+        platform_stmt = select(CrawlTask.platform, func.count()).where(running).group_by(CrawlTask.platform)
+        submitter_stmt = (
+            select(CrawlTask.submitter, func.count())
+            .where(running, CrawlTask.submitter.is_not(None))
+            .group_by(CrawlTask.submitter)
+        )
+        return (
+            {platform: count for platform, count in self._db.execute(platform_stmt).all()},
+            {submitter: count for submitter, count in self._db.execute(submitter_stmt).all()},
+        )
+
+    def renew_lease(self, task_id: int, lease_token: str, lease_sec: float) -> bool:
+        result = self._db.execute(
+            update(CrawlTask)
+            .where(CrawlTask.id == task_id, CrawlTask.worker_id == lease_token, CrawlTask.status == "RUNNING")
+            .values(lease_expires_at=datetime.now(tz=timezone.utc) + timedelta(seconds=lease_sec))
+        )
+        return result.rowcount == 1
+
+    def release(
+        self,
+        task_id: int,
+        lease_token: str,
+        status: str,
+        last_error: str | None = None,
+        retry_count: int | None = None,
+    ) -> bool:
+        values: dict[str, object] = {"status": status, "worker_id": None, "lease_expires_at": None}
+        if last_error is not None:
+            values["last_error"] = last_error
+        if retry_count is not None:
+            values["retry_count"] = retry_count
+        result = self._db.execute(
+            update(CrawlTask).where(CrawlTask.id == task_id, CrawlTask.worker_id == lease_token).values(**values)
+        )
+        return result.rowcount == 1
+
     def update_status(
         self,
         task_id: int,
@@ -31,7 +302,8 @@ class CrawlTaskRepository:
         cursor_json: dict | None = None,
         last_error: str | None = None,
         retry_count: int | None = None,
-    ) -> None:
+        lease_token: str | None = None,
+    ) -> bool:
         values: dict[str, object] = {"status": status}
         if cursor_json is not None:
             values["cursor_json"] = cursor_json
@@ -39,5 +311,29 @@ class CrawlTaskRepository:
             values["last_error"] = last_error
         if retry_count is not None:
             values["retry_count"] = retry_count
-        self._db.execute(update(CrawlTask).where(CrawlTask.id == task_id).values(**values))
+        stmt = update(CrawlTask).where(CrawlTask.id == task_id)
+        if lease_token is not None:
+            stmt = stmt.where(CrawlTask.worker_id == lease_token)
+        return self._db.execute(stmt.values(**values)).rowcount == 1
+
+
+def _running_count(now: datetime, condition: ColumnElement[bool]) -> ScalarSelect[int]:
+    return (
+        select(func.count())
+        .select_from(_running)
+        .where(_running.status == "RUNNING", _running.lease_expires_at >= now, condition)
+        .scalar_subquery()
+    )
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
 
+def _effective_priority(task: CrawlTask, now: datetime, aging_sec: float, deadline_window_sec: float) -> float:
+    score = float(task.priority or 0)
+    if aging_sec > 0:
+        score += max(0.0, (now - _as_utc(task.created_at)).total_seconds()) / aging_sec
+    if task.deadline_at is not None and (_as_utc(task.deadline_at) - now).total_seconds() <= deadline_window_sec:
+        score += 1000.0
+    return score
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from database.models import PipelineRun
+
+
+class PipelineRunRepository:
+    def __init__(self, db: Session) -> None:
+        self._db = db
+
+    def list_stale(self, keep_runs: int, keep_days: float, now: datetime | None = None) -> list[PipelineRun]:
+        if keep_runs <= 0 and keep_days <= 0:
+            return []
+        now = now or datetime.now(tz=timezone.utc)
+        cutoff = now - timedelta(days=keep_days) if keep_days > 0 else None
+        stmt = select(PipelineRun).order_by(PipelineRun.platform, PipelineRun.video_id, PipelineRun.id.desc())
+        stale: list[PipelineRun] = []
+        seen: dict[tuple[str, str], int] = {}
+        kept_success: set[tuple[str, str]] = set()
+        for run in self._db.execute(stmt).scalars():
+            if run.status == "RUNNING":
+                continue
+            key = (run.platform, run.video_id)
+            rank = seen.get(key, 0)
+            seen[key] = rank + 1
+            if run.status == "SUCCEEDED" and key not in kept_success:
+                kept_success.add(key)
+                continue
+            too_many = keep_runs > 0 and rank >= keep_runs
+            too_old = cutoff is not None and _as_utc(run.started_at) < cutoff
+            if too_many or too_old:
+                stale.append(run)
+        return stale
+
+    def delete_rows(self, model: Any, pipeline_run_id: int, limit: int) -> int:
+        ids = self._db.execute(select(model.id).where(model.pipeline_run_id == pipeline_run_id).limit(limit)).scalars().all()
+        if not ids:
+            return 0
+        self._db.execute(delete(model).where(model.id.in_(ids)))
+        return len(ids)
+
+    def delete(self, pipeline_run_id: int) -> None:
+        self._db.execute(delete(PipelineRun).where(PipelineRun.id == pipeline_run_id))
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
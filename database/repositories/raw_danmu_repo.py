@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+from typing import Any
+
 from sqlalchemy import select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
@@ -20,6 +23,28 @@ class RawDanmuRepository:
             return False
         return True
 
+    def insert_many(self, rows: list[dict[str, Any]]) -> int:
+        if not rows:
+            return 0
+        dialect = self._db.get_bind(RawDanmu).dialect.name
+        if dialect == "sqlite":
+            stmt = sqlite.insert(RawDanmu).on_conflict_do_nothing(
+                index_elements=[RawDanmu.platform, RawDanmu.video_id, RawDanmu.dedup_key]
+            )
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(RawDanmu).on_conflict_do_nothing(constraint="uq_raw_danmu_dedup")
+        elif dialect in ("mysql", "mariadb"):
+            result = self._db.execute(mysql.insert(RawDanmu).prefix_with("IGNORE"), rows)
+            return int(result.rowcount or 0)
+        else:
+            return sum(1 for row in rows if self.insert_one(RawDanmu(**row)))
+        result = self._db.execute(stmt.returning(RawDanmu.id), rows)
+        return len(result.all())
+
+    def load_dedup_keys(self, platform: str, video_id: str) -> set[int]:
+        stmt = select(RawDanmu.dedup_key).where(RawDanmu.platform == platform, RawDanmu.video_id == video_id)
+        return set(self._db.execute(stmt).scalars().all())
+
     def list_by_video(self, platform: str, video_id: str, limit: int = 1000) -> list[RawDanmu]:
         stmt = (
             select(RawDanmu)
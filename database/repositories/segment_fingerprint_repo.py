@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database.models import SegmentFingerprint
+
+
+class SegmentFingerprintRepository:
+    def __init__(self, db: Session) -> None:
+        self._db = db
+
+    def load_hashes(self, platform: str, video_id: str) -> dict[tuple[int, int], str]:
+        stmt = select(SegmentFingerprint.cid, SegmentFingerprint.segment_index, SegmentFingerprint.payload_hash).where(
+            SegmentFingerprint.platform == platform, SegmentFingerprint.video_id == video_id
+        )
+        return {(int(cid), int(seg)): payload_hash for cid, seg, payload_hash in self._db.execute(stmt).all()}
+
+    def upsert(
+        self, platform: str, video_id: str, cid: int, segment_index: int, payload_hash: str, elem_count: int
+    ) -> SegmentFingerprint:
+        stmt = select(SegmentFingerprint).where(
+            SegmentFingerprint.platform == platform,
+            SegmentFingerprint.video_id == video_id,
+            SegmentFingerprint.cid == cid,
+            SegmentFingerprint.segment_index == segment_index,
+        )
+        existing = self._db.execute(stmt).scalars().first()
+        if existing is not None:
+            existing.payload_hash = payload_hash
+            existing.elem_count = elem_count
+            self._db.flush()
+            return existing
+        item = SegmentFingerprint(
+            platform=platform,
+            video_id=video_id,
+            cid=cid,
+            segment_index=segment_index,
+            payload_hash=payload_hash,
+            elem_count=elem_count,
+        )
+        self._db.add(item)
+        self._db.flush()
+        return item
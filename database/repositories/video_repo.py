@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import time
+from typing import Any
+
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
@@ -23,3 +26,36 @@ class VideoRepository:
         self._db.flush()
         return video
 
+    def get_many(self, platform: str, video_ids: list[str], chunk_size: int = 500) -> dict[str, Video]:
+        found: dict[str, Video] = {}
+        for i in range(0, len(video_ids), chunk_size):
+            stmt = select(Video).where(Video.platform == platform, Video.video_id.in_(video_ids[i : i + chunk_size]))
+            for video in self._db.execute(stmt).scalars().all():
+                found[video.video_id] = video
+        return found
+
+    def ensure_many(self, platform: str, video_ids: list[str]) -> dict[str, Video]:
+        videos = self.get_many(platform, video_ids)
+        missing = [Video(platform=platform, video_id=video_id) for video_id in video_ids if video_id not in videos]
+        if missing:
+            self._db.add_all(missing)
+            self._db.flush()
+            videos.update((video.video_id, video) for video in missing)
+        return videos
+
+    def get_cached_pages(self, platform: str, video_id: str, ttl_sec: float) -> list[dict[str, Any]] | None:
+        video = self.get_by_platform_video_id(platform=platform, video_id=video_id)
+        meta = (video.metadata_json if video is not None else None) or {}
+        pages = meta.get("pages")
+        resolved_at = meta.get("pages_resolved_at")
+        if not pages or not isinstance(resolved_at, (int, float)) or time.time() - resolved_at > ttl_sec:
+            return None
+        return [dict(page) for page in pages]
+
+    def put_pages(self, platform: str, video_id: str, pages: list[dict[str, Any]]) -> None:
+        video = self.get_or_create(platform=platform, video_id=video_id)
+        meta = dict(video.metadata_json or {})
+        meta["pages"] = [{k: v for k, v in page.items() if k != "segment_index"} for page in pages]
+        meta["pages_resolved_at"] = time.time()
+        video.metadata_json = meta
+        self._db.flush()
@@ -1,22 +1,140 @@
 from __future__ import annotations
 
-from collections.abc import Generator
+from collections.abc import AsyncGenerator, Generator
+from dataclasses import replace
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
 
 from config.settings import settings
+from database.sqlite_profile import SqliteProfile, apply_sqlite_profile
+from monitoring.metrics import instrument_engine
 
 
-def create_session_factory() -> sessionmaker[Session]:
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mariadb": "mariadb+aiomysql",
+}
+
+
+def create_db_engine(
+    database_url: str | None = None,
+    sqlite_profile: SqliteProfile | None = None,
+    pool_size: int | None = None,
+    max_overflow: int | None = None,
+) -> Engine:
+    database_url = database_url or settings.database_url
     connect_args: dict[str, object] = {}
-    if settings.database_url.startswith("sqlite:"):
+    if database_url.startswith("sqlite:"):
         connect_args = {"check_same_thread": False}
-    engine = create_engine(settings.database_url, future=True, pool_pre_ping=True, connect_args=connect_args)
-    return sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    engine = create_engine(
+        database_url,
+        future=True,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+        **_pool_options(database_url, pool_size, max_overflow),
+    )
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_profile(engine, sqlite_profile or SqliteProfile.from_settings(settings))
+    if settings.metrics_enabled:
+        instrument_engine(engine)
+    return engine
+
+
+def create_read_engine() -> Engine:
+    database_url = settings.read_database_url or settings.database_url
+    if _is_memory_sqlite(database_url):
+        return engine
+    return create_db_engine(
+        database_url,
+        replace(SqliteProfile.from_settings(settings), read_only=True),
+        pool_size=settings.read_db_pool_size,
+        max_overflow=settings.read_db_max_overflow,
+    )
+
+
+def create_session_factory(engine: Engine | None = None) -> sessionmaker[Session]:
+    return sessionmaker(bind=engine or create_db_engine(), autoflush=False, autocommit=False, future=True)
+
+
+def async_database_url(database_url: str) -> str:
+    url = make_url(database_url)
+    async_driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    if async_driver is None:
+        raise ValueError(f"不支持的异步数据库: {url.get_backend_name()}")
+    if url.drivername in _ASYNC_DRIVERS.values():
+        return database_url
+    return url.set(drivername=async_driver).render_as_string(hide_password=False)
+
+
+def create_async_session_factory(read_only: bool = False) -> async_sessionmaker[AsyncSession]:
+    database_url = settings.async_database_url or async_database_url(settings.database_url)
+    pool_size, max_overflow = settings.db_pool_size, settings.db_max_overflow
+    if read_only:
+        if settings.async_read_database_url:
+            database_url = settings.async_read_database_url
+        elif settings.read_database_url:
+            database_url = async_database_url(settings.read_database_url)
+        pool_size, max_overflow = settings.read_db_pool_size, settings.read_db_max_overflow
+    engine = create_async_engine(database_url, pool_pre_ping=True, **_pool_options(database_url, pool_size, max_overflow))
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_profile(engine.sync_engine, replace(SqliteProfile.from_settings(settings), read_only=read_only))
+    if settings.metrics_enabled:
+        instrument_engine(engine.sync_engine)
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+def _pool_options(database_url: str, pool_size: int | None, max_overflow: int | None) -> dict[str, int]:
+    if _is_memory_sqlite(database_url):
+        return {}
+    options: dict[str, int] = {}
+    if pool_size is not None:
+        options["pool_size"] = pool_size
+    if max_overflow is not None:
+        options["max_overflow"] = max_overflow
+    return options
+
+
+def _is_memory_sqlite(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+engine = create_db_engine(pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow)
+SessionLocal = create_session_factory(engine)
+read_engine = create_read_engine()
+ReadSessionLocal = create_session_factory(read_engine)
+_async_session_factory: async_sessionmaker[AsyncSession] | None = None
+_async_read_session_factory: async_sessionmaker[AsyncSession] | None = None
 
 
-SessionLocal = create_session_factory()
+def get_async_session_factory() -> async_sessionmaker[AsyncSession]:
+    global _async_session_factory
+    if _async_session_factory is None:
+        _async_session_factory = create_async_session_factory()
+    return _async_session_factory
+
+
+def get_async_read_session_factory() -> async_sessionmaker[AsyncSession]:
+    global _async_read_session_factory
+    if _async_read_session_factory is None:
+        if read_engine is engine:
+            _async_read_session_factory = get_async_session_factory()
+        else:
+            _async_read_session_factory = create_async_session_factory(read_only=True)
+    return _async_read_session_factory
+
+
+async def dispose_async_engine() -> None:
+    global _async_session_factory, _async_read_session_factory
+    factories = {_async_session_factory, _async_read_session_factory} - {None}
+    _async_session_factory = _async_read_session_factory = None
+    for factory in factories:
+        await factory.kw["bind"].dispose()
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -26,3 +144,20 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+
+def get_read_db() -> Generator[Session, None, None]:
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with get_async_session_factory()() as db:
+        yield db
+
+
+async def get_async_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with get_async_read_session_factory()() as db:
+        yield db
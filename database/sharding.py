@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from pathlib import Path
+
+from sqlalchemy import MetaData
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from config.settings import settings
+from database.migrations import upgrade_schema
+from database.models import CleanDanmu, RawDanmu
+from database.session import SessionLocal, create_db_engine
+
+
+SHARDED_MODELS = (RawDanmu, CleanDanmu)
+
+
+def _shard_metadata() -> MetaData:
+    metadata = MetaData()
+    names = {model.__table__.name for model in SHARDED_MODELS}
+    for model in SHARDED_MODELS:
+        table = model.__table__.to_metadata(metadata)
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] not in names:
+                table.constraints.discard(constraint)
+                for column in constraint.columns:
+                    column.foreign_keys.difference_update(constraint.elements)
+                table.foreign_keys.difference_update(constraint.elements)
+    return metadata
+
+
+class ShardRouter:
+    def __init__(self, url_template: str, shard_count: int) -> None:
+        if shard_count < 2:
+            raise ValueError(f"分片数至少为 2: {shard_count}")
+        if "{shard}" not in url_template:
+            raise ValueError(f"分片地址模板缺少 {{shard}} 占位符: {url_template}")
+        self._url_template = url_template
+        self._shard_count = shard_count
+        self._engines: dict[int, Engine] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shard_count(self) -> int:
+        return self._shard_count
+
+    def shard_for(self, platform: str, video_id: str) -> int:
+        digest = hashlib.blake2b(f"{platform}:{video_id}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self._shard_count
+
+    def engine(self, shard: int) -> Engine:
+        engine = self._engines.get(shard)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(shard)
+            if engine is None:
+                engine = create_db_engine(self._url_template.format(shard=shard))
+                _init_shard(engine)
+                self._engines[shard] = engine
+        return engine
+
+    def engine_for(self, platform: str, video_id: str) -> Engine:
+        return self.engine(self.shard_for(platform, video_id))
+
+    def binds(self, platform: str, video_id: str) -> dict[type, Engine]:
+        engine = self.engine_for(platform, video_id)
+        return {model: engine for model in SHARDED_MODELS}
+
+    def engines(self) -> list[Engine]:
+        return [self.engine(shard) for shard in range(self._shard_count)]
+
+    def dispose(self) -> None:
+        with self._lock:
+            engines, self._engines = list(self._engines.values()), {}
+        for engine in engines:
+            engine.dispose()
+
+
+def _init_shard(engine: Engine) -> None:
+    if engine.dialect.name == "sqlite" and engine.url.database:
+        Path(engine.url.database).parent.mkdir(parents=True, exist_ok=True)
+    _shard_metadata().create_all(bind=engine)
+    upgrade_schema(engine)
+
+
+def create_shard_router() -> ShardRouter | None:
+    if settings.shard_count < 2:
+        return None
+    return ShardRouter(settings.shard_url_template, settings.shard_count)
+
+
+def shard_session(platform: str, video_id: str) -> Session:
+    if shard_router is None:
+        return SessionLocal()
+    return SessionLocal(binds=shard_router.binds(platform, video_id))
+
+
+shard_router = create_shard_router()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from config.settings import Settings
+
+
+logger = logging.getLogger(__name__)
+
+_JOURNAL_MODES = {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF"}
+_SYNCHRONOUS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+_TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+_AUTO_VACUUM = {"NONE", "FULL", "INCREMENTAL"}
+
+
+@dataclass(frozen=True, slots=True)
+class SqliteProfile:
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    cache_size_kib: int = 65536
+    mmap_size_mb: int = 256
+    temp_store: str = "MEMORY"
+    busy_timeout_ms: int = 5000
+    auto_vacuum: str = "INCREMENTAL"
+    read_only: bool = False
+
+    def __post_init__(self) -> None:
+        for name, value, allowed in (
+            ("journal_mode", self.journal_mode, _JOURNAL_MODES),
+            ("synchronous", self.synchronous, _SYNCHRONOUS),
+            ("temp_store", self.temp_store, _TEMP_STORES),
+            ("auto_vacuum", self.auto_vacuum, _AUTO_VACUUM),
+        ):
+            if value.upper() not in allowed:
+                raise ValueError(f"无效的 SQLite {name}: {value}，可选 {sorted(allowed)}")
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> SqliteProfile:
+        return cls(
+            journal_mode=settings.sqlite_journal_mode,
+            synchronous=settings.sqlite_synchronous,
+            cache_size_kib=settings.sqlite_cache_size_kib,
+            mmap_size_mb=settings.sqlite_mmap_size_mb,
+            temp_store=settings.sqlite_temp_store,
+            busy_timeout_ms=settings.sqlite_busy_timeout_ms,
+            auto_vacuum=settings.sqlite_auto_vacuum,
+        )
+
+    def pragmas(self) -> list[str]:
+        pragmas = [f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}"]
+        if self.read_only:
+            pragmas.append("PRAGMA query_only=ON")
+        else:
+            pragmas += [f"PRAGMA auto_vacuum={self.auto_vacuum.upper()}", f"PRAGMA journal_mode={self.journal_mode.upper()}"]
+        return pragmas + [
+            f"PRAGMA synchronous={self.synchronous.upper()}",
+            f"PRAGMA cache_size={-int(self.cache_size_kib)}",
+            f"PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024}",
+            f"PRAGMA temp_store={self.temp_store.upper()}",
+        ]
+
+
+def apply_sqlite_profile(engine: Engine, profile: SqliteProfile) -> None:
+    pragmas = profile.pragmas()
+
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    event.listen(engine, "connect", on_connect)
+
+
+def run_sqlite_maintenance(engine: Engine, analysis_limit: int = 400) -> dict[str, Any]:
+    database = engine.url.database
+    before = _file_sizes(database)
+    with engine.connect() as conn:
+        busy, wal_pages, checkpointed = conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).one()
+        conn.execute(text(f"PRAGMA analysis_limit={int(analysis_limit)}"))
+        conn.execute(text("PRAGMA optimize"))
+        conn.commit()
+    return {
+        "wal_busy": bool(busy),
+        "wal_pages": wal_pages,
+        "checkpointed_pages": checkpointed,
+        "size_before": before,
+        "size_after": _file_sizes(database),
+    }
+
+
+async def sqlite_maintenance_loop(engines: Callable[[], list[Engine]], interval_sec: float) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        for engine in engines():
+            if engine.dialect.name != "sqlite":
+                continue
+            try:
+                report = await asyncio.to_thread(run_sqlite_maintenance, engine)
+                logger.info("sqlite maintenance %s %s", engine.url.database, report)
+            except Exception:
+                logger.exception("sqlite maintenance failed: %s", engine.url.database)
+
+
+def _file_sizes(database: str | None) -> dict[str, int]:
+    if not database or database == ":memory:":
+        return {}
+    sizes: dict[str, int] = {}
+    for suffix in ("", "-wal"):
+        path = database + suffix
+        if os.path.exists(path):
+            sizes["db" if not suffix else "wal"] = os.path.getsize(path)
+    return sizes
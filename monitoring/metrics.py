@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], lock: threading.Lock) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = lock
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...], extra: dict[str, str] | None = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], lock: threading.Lock) -> None:
+        super().__init__(name, help_text, labelnames, lock)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._labels(key)} {_format(value)}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], lock: threading.Lock) -> None:
+        super().__init__(name, help_text, labelnames, lock)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def replace(self, values: dict[tuple[str, ...], float]) -> None:
+        with self._lock:
+            self._values = {tuple(str(v) for v in key): float(value) for key, value in values.items()}
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._labels(key)} {_format(value)}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: tuple[str, ...], lock: threading.Lock, buckets: tuple[float, ...]
+    ) -> None:
+        super().__init__(name, help_text, labelnames, lock)
+        self._buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self._buckets) + 2)
+                self._series[key] = series
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self._buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def render(self) -> list[str]:
+        lines: list[str] = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for bound, count in zip((*self._buckets, math.inf), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format(bound)
+                lines.append(f"{self.name}_bucket{self._labels(key, {'le': le})} {_format(cumulative)}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format(series[-1])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {_format(cumulative)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: dict[str, _Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames, self._lock))
+
+    def gauge(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames, self._lock))
+
+    def histogram(
+        self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, self._lock, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines: list[str] = []
+        with self._lock:
+            for metric in self._metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Any) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def instrument_engine(engine: Engine) -> None:
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    started = conn.info.get("metrics_started")
+    if started:
+        db_statement_seconds.observe(time.perf_counter() - started.pop(), operation=_statement_operation(statement))
+
+
+def _handle_error(exception_context: Any) -> None:
+    conn = exception_context.connection
+    started = conn.info.get("metrics_started") if conn is not None else None
+    if started:
+        started.pop()
+        db_statement_errors.inc(operation=_statement_operation(exception_context.statement or ""))
+
+
+def _statement_operation(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    operation = head[0].upper() if head else ""
+    return operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "PRAGMA") else "OTHER"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+crawl_segments = registry.counter("crawl_segments_total", "Danmaku segments fetched", ("platform",))
+crawl_segments_skipped = registry.counter("crawl_segments_skipped_total", "Segments skipped as unchanged", ("platform",))
+crawl_bytes = registry.counter("crawl_bytes_total", "Segment payload bytes fetched", ("platform",))
+crawl_decode_seconds = registry.histogram("crawl_decode_seconds", "Segment decode time", ("platform",))
+crawl_rows_inserted = registry.counter("crawl_rows_inserted_total", "Danmaku rows inserted", ("platform", "task_type"))
+crawl_rows_duplicate = registry.counter("crawl_rows_duplicate_total", "Danmaku rows dropped as duplicates", ("platform", "task_type"))
+
+scheduler_queue_depth = registry.gauge("scheduler_queue_depth", "Pending crawl tasks", ("priority",))
+scheduler_claim_seconds = registry.histogram("scheduler_claim_seconds", "Time spent claiming tasks")
+scheduler_task_wait_seconds = registry.histogram(
+    "scheduler_task_wait_seconds", "Time from task creation to claim", buckets=(1, 5, 15, 60, 300, 900, 3600, 14400, 86400)
+)
+scheduler_task_seconds = registry.histogram(
+    "scheduler_task_seconds", "Crawl task run time", ("status",), buckets=(1, 5, 15, 60, 300, 900, 3600, 14400)
+)
+
+pipeline_rows = registry.counter("pipeline_rows_total", "Rows processed per pipeline stage", ("stage",))
+pipeline_stage_seconds = registry.counter("pipeline_stage_seconds_total", "Time spent per pipeline stage", ("stage",))
+pipeline_rows_per_second = registry.gauge("pipeline_rows_per_second", "Rows/s per stage in the last pipeline run", ("stage",))
+
+analyzer_seconds = registry.histogram("analyzer_duration_seconds", "Analyzer run time", ("analyzer",))
+
+http_request_seconds = registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+
+db_statement_seconds = registry.histogram("db_statement_duration_seconds", "SQL statement time", ("operation",))
+db_statement_errors = registry.counter("db_statement_errors_total", "Failed SQL statements", ("operation",))
+
+retention_rows_deleted = registry.counter("retention_rows_deleted_total", "Rows removed by the retention compactor", ("table",))
+retention_bytes_reclaimed = registry.counter("retention_bytes_reclaimed_total", "SQLite bytes reclaimed by the compactor")
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, RawDanmu
+from database.repositories.raw_danmu_repo import RawDanmuRepository
+from database.session import create_db_engine
+from database.sqlite_profile import SqliteProfile, run_sqlite_maintenance
+
+
+BASELINE = SqliteProfile(
+    journal_mode="DELETE",
+    synchronous="FULL",
+    cache_size_kib=2000,
+    mmap_size_mb=0,
+    temp_store="DEFAULT",
+    busy_timeout_ms=5000,
+    auto_vacuum="NONE",
+)
+
+
+def make_rows(video_id: str, start: int, count: int) -> list[dict]:
+    return [
+        {
+            "platform": "bilibili",
+            "video_id": video_id,
+            "content": f"弹幕{i}",
+            "video_ts": random.uniform(0, 1800),
+            "user_id_hash": f"u{i % 500}",
+            "dedup_key": i,
+            "raw_json": {"mode": 1, "i": i},
+        }
+        for i in range(start, start + count)
+    ]
+
+
+def bench_profile(name: str, profile: SqliteProfile, rows: int, batch: int, queries: int, concurrent_sec: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", profile)
+        Base.metadata.create_all(bind=engine)
+        factory = sessionmaker(bind=engine, autoflush=False, future=True)
+        videos = [f"BV{i:04d}" for i in range(4)]
+
+        started = time.perf_counter()
+        with factory() as db:
+            repo = RawDanmuRepository(db)
+            for offset in range(0, rows, batch):
+                repo.insert_many(make_rows(videos[(offset // batch) % len(videos)], offset, min(batch, rows - offset)))
+                db.commit()
+        ingest_sec = time.perf_counter() - started
+
+        bucket = func.cast(RawDanmu.video_ts / 60, RawDanmu.id.type)
+        started = time.perf_counter()
+        with factory() as db:
+            for i in range(queries):
+                video_id = videos[i % len(videos)]
+                db.execute(
+                    select(bucket, func.count()).where(RawDanmu.platform == "bilibili", RawDanmu.video_id == video_id).group_by(bucket)
+                ).all()
+                RawDanmuRepository(db).list_by_video("bilibili", video_id, limit=500)
+        query_sec = time.perf_counter() - started
+
+        stop = threading.Event()
+        counts = {"writes": 0, "reads": 0, "locked": 0}
+        lock = threading.Lock()
+
+        def writer() -> None:
+            offset = rows
+            with factory() as db:
+                while not stop.is_set():
+                    try:
+                        RawDanmuRepository(db).insert_many(make_rows("BVlive", offset, 50))
+                        db.commit()
+                        offset += 50
+                        with lock:
+                            counts["writes"] += 1
+                    except OperationalError:
+                        db.rollback()
+                        with lock:
+                            counts["locked"] += 1
+
+        def reader() -> None:
+            with factory() as db:
+                while not stop.is_set():
+                    try:
+                        db.execute(select(func.count()).select_from(RawDanmu).where(RawDanmu.video_id == "BVlive")).scalar()
+                        db.rollback()
+                        with lock:
+                            counts["reads"] += 1
+                    except OperationalError:
+                        db.rollback()
+                        with lock:
+                            counts["locked"] += 1
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(concurrent_sec)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        maintenance = run_sqlite_maintenance(engine) if profile.journal_mode.upper() == "WAL" else None
+        engine.dispose()
+    return {
+        "profile": name,
+        "ingest_rows_per_sec": round(rows / ingest_sec, 1),
+        "queries_per_sec": round(queries / query_sec, 1),
+        "concurrent_writes_per_sec": round(counts["writes"] / concurrent_sec, 1),
+        "concurrent_reads_per_sec": round(counts["reads"] / concurrent_sec, 1),
+        "locked_errors": counts["locked"],
+        "maintenance": maintenance,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="对比 SQLite 默认配置与调优配置的写入、查询与并发读写吞吐")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=500, help="每次提交写入的行数")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrent-sec", type=float, default=3.0, help="一个写线程加三个读线程并发运行的秒数")
+    args = parser.parse_args()
+
+    random.seed(0)
+    for name, profile in (("baseline", BASELINE), ("tuned", SqliteProfile())):
+        print(json.dumps(bench_profile(name, profile, args.rows, args.batch, args.queries, args.concurrent_sec), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
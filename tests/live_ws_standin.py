@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import time
+import zlib
+from pathlib import Path
+
+from aiohttp import WSMsgType, web
+
+from crawlers.platforms.bilibili_live_proto import (
+    OP_AUTH,
+    OP_AUTH_REPLY,
+    OP_HEARTBEAT,
+    OP_HEARTBEAT_REPLY,
+    OP_MESSAGE,
+    PROTOVER_ZLIB,
+    pack_json,
+    pack_packet,
+    unpack_packets,
+)
+
+
+def load_frames(path: Path | None, synthetic: int) -> list[bytes]:
+    if path is not None:
+        return [base64.b64decode(line) for line in path.read_text(encoding="ascii").splitlines() if line.strip()]
+    frames = []
+    for i in range(synthetic):
+        body = {
+            "cmd": "DANMU_MSG",
+            "info": [[0, 1, 25, 16777215, int(time.time() * 1000) + i, 0, 0, f"hash{i % 97}"], f"弹幕{i}", [0, "", 0], [i % 30]],
+        }
+        inner = pack_json(OP_MESSAGE, body)
+        frames.append(pack_packet(OP_MESSAGE, zlib.compress(inner), protover=PROTOVER_ZLIB))
+    return frames
+
+
+def create_app(frames: list[bytes], rate: float, loops: int) -> web.Application:
+    async def sub(request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        auth = await ws.receive()
+        if auth.type != WSMsgType.BINARY or not any(op == OP_AUTH for op, _ in unpack_packets(auth.data)):
+            await ws.close()
+            return ws
+        await ws.send_bytes(pack_json(OP_AUTH_REPLY, {"code": 0}))
+
+        async def answer_heartbeats() -> None:
+            async for msg in ws:
+                if msg.type == WSMsgType.BINARY and any(op == OP_HEARTBEAT for op, _ in unpack_packets(msg.data)):
+                    await ws.send_bytes(pack_packet(OP_HEARTBEAT_REPLY, (1).to_bytes(4, "big")))
+
+        reader = asyncio.create_task(answer_heartbeats())
+        interval = 1.0 / rate if rate > 0 else 0.0
+        started = time.monotonic()
+        sent = 0
+        try:
+            for _ in range(loops):
+                for frame in frames:
+                    await ws.send_bytes(frame)
+                    sent += 1
+                    delay = started + sent * interval - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+        finally:
+            reader.cancel()
+            await ws.close()
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/sub", sub)
+    return app
+
+
+async def self_check(frames: list[bytes], rate: float, loops: int, port: int) -> None:
+    from crawlers.http_pool import http_pool
+    from crawlers.platforms.bilibili import BilibiliAdapter
+
+    runner = web.AppRunner(create_app(frames, rate, loops))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    adapter = BilibiliAdapter(pool=http_pool, live_ws_url=f"ws://127.0.0.1:{port}/sub")
+    started = time.monotonic()
+    received = 0
+    async for _ in adapter.crawl_live("live:1"):
+        received += 1
+    elapsed = time.monotonic() - started
+    await http_pool.close()
+    await runner.cleanup()
+    print(json.dumps({"received": received, "elapsed_sec": round(elapsed, 3), "events_per_sec": round(received / elapsed, 1)}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bilibili 直播弹幕 websocket 本地替身，按指定速率回放录制帧")
+    parser.add_argument("--frames", type=Path, default=None, help="LIVE_RECORD_PATH 录制的帧文件（每行一个 base64 帧）")
+    parser.add_argument("--synthetic", type=int, default=1000, help="未提供录制文件时生成的合成弹幕帧数")
+    parser.add_argument("--rate", type=float, default=200.0, help="每秒发送帧数，<=0 表示不限速")
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--check", action="store_true", help="启动替身并用 BilibiliAdapter.crawl_live 收完所有帧后退出")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.synthetic)
+    if args.check:
+        asyncio.run(self_check(frames, args.rate, args.loops, args.port))
+        return
+    web.run_app(create_app(frames, args.rate, args.loops), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
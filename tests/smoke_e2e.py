@@ -1,25 +1,57 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+import asyncio
+import json
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from analytics.nlp.burst import detect_bursty_tokens
+from analytics.nlp.keywords import top_keywords
 from analytics.runner import run_analysis
-from crawlers.utils import sha256_hex
+from analytics.social.mentions import build_mention_network_summary
+from analytics.statistical.cognitive import cognitive_metrics_by_bucket
+from analytics.statistical.time_series import count_by_time_bucket, sentiment_ratio_by_bucket, user_activity_summary
+from analytics.statistical.user_profile import danmu_type_distribution, user_segmentation_summary
+from config.settings import settings
+from crawlers.archive import SegmentArchive
+from crawlers.platforms.bilibili import BilibiliAdapter, BilibiliReplayAdapter
+from crawlers.platforms.bilibili_live_proto import (
+    OP_AUTH_REPLY,
+    OP_HEARTBEAT_REPLY,
+    OP_MESSAGE,
+    PROTOVER_ZLIB,
+    pack_json,
+    pack_packet,
+    unpack_packets,
+)
+from crawlers.platforms.bilibili_proto import DmSegMobileReply
+from crawlers.rate_limit import AdaptiveRateLimiter, backoff_delay
+from crawlers.utils import dedup_key, sha256_hex, user_hash
 from data_pipeline.loader.pipeline_runner import run_pipeline
+from data_pipeline.loader.snapshot import load_snapshot, snapshot_available
 from database.init_db import init_db
-from database.models import RawDanmu, Video
-from database.session import SessionLocal
-from sqlalchemy import delete
+from database.migrations import upgrade_schema
+from database.models import Base, CleanDanmu, CrawlTask, RawDanmu, Video
+from database.repositories.crawl_task_repo import CrawlTaskRepository
+from database.repositories.raw_danmu_repo import RawDanmuRepository
+from database.repositories.segment_fingerprint_repo import SegmentFingerprintRepository
+from database.session import dispose_async_engine, get_async_session_factory
+from database.sharding import shard_session
+from sqlalchemy import create_engine, delete, func, inspect, select, update
+from sqlalchemy.orm import Session
 from visualization.dashboard.server import get_time_series
 from visualization.report.html_report import generate_html_report
 
 
 def main() -> None:
     init_db()
-    db = SessionLocal()
+    platform = "bilibili"
+    video_id = "BV_SMOKE_TEST"
+    db = shard_session(platform, video_id)
     try:
-        platform = "bilibili"
-        video_id = "BV_SMOKE_TEST"
 
         db.execute(delete(Video).where(Video.platform == platform, Video.video_id == video_id))
         db.execute(delete(RawDanmu).where(RawDanmu.platform == platform, RawDanmu.video_id == video_id))
@@ -30,16 +62,26 @@ def main() -> None:
 
         _seed_raw_danmu(db, platform, video_id)
 
+        settings.pipeline_snapshot_enabled = snapshot_available()
         danmu_run = run_pipeline(db, platform=platform, video_id=video_id, config_json={"smoke": True})
         run_analysis(db, platform=platform, video_id=video_id, pipeline_run_id=danmu_run.id)
+        _check_snapshot_parity(db, platform, video_id, danmu_run.id)
 
-        danmu_ts = get_time_series(platform=platform, video_id=video_id, metric_name="danmu_count", bucket_sec=10, db=db)
+        danmu_ts = asyncio.run(_fetch_time_series(platform, video_id, "danmu_count"))
         assert all(int(r["x_sec"]) >= 0 for r in danmu_ts), "danmu x_sec should be non-negative"
 
         out = Path("data/reports/smoke_report.html")
         generate_html_report(db, platform=platform, video_id=video_id, output_path=out)
         assert out.exists(), "report should exist"
 
+        _check_insert_many_conflicts()
+        _check_crawl_task_leases()
+        _check_rate_limiter()
+        _check_segment_fingerprint_skip()
+        _check_dedup_key_stability()
+        _check_legacy_schema_upgrade()
+        _check_live_proto_round_trip()
+
         print("smoke ok")
         print("danmu_count points:", len(danmu_ts))
         print("report:", str(out))
@@ -47,6 +89,281 @@ def main() -> None:
         db.close()
 
 
+def _check_snapshot_parity(db, platform: str, video_id: str, pipeline_run_id: int) -> None:
+    if not snapshot_available():
+        print("snapshot parity skipped: pyarrow not installed")
+        return
+    clean_rows = db.execute(
+        select(func.count()).select_from(CleanDanmu).where(CleanDanmu.pipeline_run_id == pipeline_run_id)
+    ).scalar_one()
+    snapshot = load_snapshot(pipeline_run_id, platform, video_id, clean_rows)
+    assert snapshot is not None, "snapshot should be loaded for the run it was written for"
+    assert load_snapshot(pipeline_run_id, platform, "BV_OTHER", clean_rows) is None, "snapshot of another video must be ignored"
+    assert load_snapshot(pipeline_run_id, platform, video_id, clean_rows + 1) is None, "stale row count must be ignored"
+
+    run = {"platform": platform, "video_id": video_id, "pipeline_run_id": pipeline_run_id}
+    analyzers = {
+        "count_by_time_bucket": lambda snap: count_by_time_bucket(db, bucket_sec=10, snapshot=snap, **run),
+        "sentiment_ratio_by_bucket": lambda snap: sentiment_ratio_by_bucket(
+            db, bucket_sec=10, label="positive", snapshot=snap, **run
+        ),
+        "user_activity_summary": lambda snap: user_activity_summary(db, snapshot=snap, **run),
+        "top_keywords": lambda snap: top_keywords(db, top_k=50, snapshot=snap, **run),
+        "cognitive_metrics_by_bucket": lambda snap: cognitive_metrics_by_bucket(db, bucket_sec=10, snapshot=snap, **run),
+        "build_mention_network_summary": lambda snap: build_mention_network_summary(db, snapshot=snap, **run),
+        "detect_bursty_tokens": lambda snap: detect_bursty_tokens(db, bucket_sec=10, snapshot=snap, **run),
+        "user_segmentation_summary": lambda snap: user_segmentation_summary(db, snapshot=snap, **run),
+        "danmu_type_distribution": lambda snap: danmu_type_distribution(db, snapshot=snap, **run),
+    }
+    reversed_snapshot = snapshot.take(list(range(snapshot.num_rows - 1, -1, -1)))
+    for name, analyzer in analyzers.items():
+        expected = analyzer(None)
+        assert analyzer(snapshot) == expected, f"{name}: snapshot and SQL results differ"
+        assert analyzer(reversed_snapshot) == expected, f"{name}: result depends on row order"
+
+
+def _scratch_session() -> Session:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return Session(engine)
+
+
+def _raw_row(video_id: str, key: int, **extra) -> dict:
+    row = {"platform": "bilibili", "video_id": video_id, "content": f"弹幕{key}", "video_ts": float(key), "dedup_key": key}
+    row.update(extra)
+    return row
+
+
+def _check_insert_many_conflicts() -> None:
+    with _scratch_session() as db:
+        repo = RawDanmuRepository(db)
+        assert repo.insert_many([_raw_row("BV_INSERT", key) for key in (1, 2, 2, 3)]) == 3, "duplicate key in one batch counted"
+        assert repo.insert_many([_raw_row("BV_INSERT", 3), _raw_row("BV_INSERT", 4)]) == 1, "existing key counted as inserted"
+        assert repo.insert_many([_raw_row("BV_OTHER", 1)]) == 1, "dedup_key should be scoped per video"
+        assert repo.insert_many([]) == 0
+        total = db.execute(select(func.count()).select_from(RawDanmu)).scalar_one()
+        assert total == 5, f"expected 5 raw rows, got {total}"
+
+
+def _check_crawl_task_leases() -> None:
+    with _scratch_session() as db:
+        repo = CrawlTaskRepository(db)
+        task, _ = repo.create_or_reuse_many("bilibili", ["BV_LEASE"], "history")["BV_LEASE"]
+        db.commit()
+        [claimed] = repo.claim("w1", 1, lease_sec=60)
+        token = claimed.worker_id
+        assert repo.claim("w2", 1, lease_sec=60) == [], "leased task claimed twice"
+        assert repo.renew_lease(task.id, token, 60), "owner could not renew its lease"
+        stale = "w0:stale"
+        assert not repo.renew_lease(task.id, stale, 60), "stale token renewed the lease"
+        assert not repo.update_status(task.id, status="RUNNING", cursor_json={"x": 1}, lease_token=stale), "stale token moved cursor"
+        assert not repo.release(task.id, stale, "SUCCEEDED"), "stale token released the task"
+        db.commit()
+
+        expired = datetime.now(tz=timezone.utc) - timedelta(seconds=1)
+        db.execute(update(CrawlTask).where(CrawlTask.id == task.id).values(lease_expires_at=expired))
+        db.commit()
+        [reclaimed] = repo.claim("w2", 1, lease_sec=60)
+        assert reclaimed.worker_id != token, "expired lease kept its token"
+        assert not repo.renew_lease(task.id, token, 60), "previous owner renewed after takeover"
+        assert not repo.release(task.id, token, "SUCCEEDED"), "previous owner released after takeover"
+        assert repo.release(task.id, reclaimed.worker_id, "SUCCEEDED"), "new owner could not release"
+        db.commit()
+        assert repo.get(task.id).status == "SUCCEEDED"
+
+
+def _check_rate_limiter() -> None:
+    limiter = AdaptiveRateLimiter(rate=8.0, min_rate=1.0, max_rate=10.0, burst=2.0, increase_step=1.0)
+    limiter.on_throttled()
+    assert limiter.current_rate == 4.0, "throttle should halve the rate"
+    for _ in range(5):
+        limiter.on_throttled()
+    assert limiter.current_rate == 1.0, "rate should not drop below min_rate"
+    for _ in range(3):
+        limiter.on_success()
+    assert limiter.current_rate == 4.0, "success should raise the rate additively"
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.current_rate == 10.0, "rate should not exceed max_rate"
+    assert limiter.throttled_count == 6
+
+    limiter.on_throttled(retry_after_sec=0.2)
+    started = time.monotonic()
+    asyncio.run(limiter.acquire())
+    assert time.monotonic() - started >= 0.15, "acquire should honour Retry-After"
+
+    for attempt in range(8):
+        cap = min(30.0, 2.0**attempt)
+        assert 0.5 * cap <= backoff_delay(attempt, 1.0, 30.0) <= 1.5 * cap, f"backoff out of range at attempt {attempt}"
+    assert backoff_delay(0, 1.0, 30.0, retry_after_sec=12.0) >= 12.0, "backoff should honour Retry-After"
+
+
+def _check_segment_fingerprint_skip() -> None:
+    cid = 777
+    cursor = {"pages": [{"page": 1, "cid": cid, "duration": 700.0}]}
+    with tempfile.TemporaryDirectory() as root, _scratch_session() as db:
+        archive = SegmentArchive(Path(root))
+        for segment_index in (1, 2):
+            archive.put(cid, segment_index, _segment_payload(segment_index, 3))
+
+        first = _replay_batches(archive, "BV_FINGERPRINT", cursor, {})
+        assert [b.segment_index for b in first[0]] == [1, 2] and first[1] == 0, "first crawl should decode every segment"
+        repo = SegmentFingerprintRepository(db)
+        for batch in first[0]:
+            repo.upsert("bilibili", "BV_FINGERPRINT", cid, batch.segment_index, batch.payload_hash, len(batch))
+        db.commit()
+        known = repo.load_hashes("bilibili", "BV_FINGERPRINT")
+        assert known == {(cid, b.segment_index): b.payload_hash for b in first[0]}, "fingerprints should round-trip"
+
+        batches, skipped = _replay_batches(archive, "BV_FINGERPRINT", cursor, known)
+        assert batches == [] and skipped == 2, "unchanged segments should be skipped"
+
+        archive.put(cid, 2, _segment_payload(2, 4))
+        batches, skipped = _replay_batches(archive, "BV_FINGERPRINT", cursor, known)
+        assert [(b.segment_index, len(b)) for b in batches] == [(2, 4)] and skipped == 1, "changed segment should be re-read"
+
+
+def _segment_payload(segment_index: int, count: int) -> bytes:
+    reply = DmSegMobileReply()
+    for i in range(count):
+        elem = reply.elems.add()
+        elem.id = segment_index * 1000 + i
+        elem.progress = (segment_index - 1) * 360_000 + i * 1000
+        elem.content = f"seg{segment_index}-{i}"
+        elem.midHash = f"{i:08x}"
+    return reply.SerializeToString()
+
+
+def _replay_batches(archive: SegmentArchive, video_id: str, cursor: dict, known: dict) -> tuple[list, int]:
+    async def crawl() -> tuple[list, int]:
+        adapter = BilibiliReplayAdapter(archive)
+        adapter.known_segment_hashes = dict(known)
+        batches = [batch async for batch in adapter.crawl_history_batches(video_id, cursor=cursor)]
+        return batches, adapter.skipped_segments
+
+    return asyncio.run(crawl())
+
+
+def _check_dedup_key_stability() -> None:
+    uid = user_hash("bilibili", "ab12cd34")
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.3456, uid) == -1537517981974663801, "dedup_key changed"
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.3456, uid, 98765) == -1010955356003319204, "dedup_key+cid changed"
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.3456, None) == 7994256391410100519, "anonymous dedup_key changed"
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.34561, None) == 7994256391410100519, "video_ts should round to ms"
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.3454, None) != 7994256391410100519
+    assert dedup_key("bilibili", "BV1xx411c7mD", "前方高能", 12.3456, None, 1) != dedup_key(
+        "bilibili", "BV1xx411c7mD", "前方高能", 12.3456, None, 2
+    ), "cid should separate pages"
+
+
+_LEGACY_SCHEMA = """
+CREATE TABLE crawl_task (
+    id INTEGER NOT NULL PRIMARY KEY, platform VARCHAR(32) NOT NULL, video_id VARCHAR(128) NOT NULL,
+    task_type VARCHAR(32) NOT NULL, status VARCHAR(16) NOT NULL, cursor_json JSON, retry_count INTEGER NOT NULL,
+    last_error TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+CREATE TABLE raw_danmu (
+    id INTEGER NOT NULL PRIMARY KEY, platform VARCHAR(32) NOT NULL, video_id VARCHAR(128) NOT NULL, content TEXT NOT NULL,
+    video_ts FLOAT NOT NULL, send_time DATETIME, user_id_hash VARCHAR(128), user_level INTEGER, like_count INTEGER,
+    dedup_hash VARCHAR(64) NOT NULL, raw_json JSON NOT NULL, ingested_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    CONSTRAINT uq_raw_danmu_dedup UNIQUE (platform, video_id, dedup_hash)
+);
+CREATE TABLE pipeline_run (
+    id INTEGER NOT NULL PRIMARY KEY, platform VARCHAR(32) NOT NULL, video_id VARCHAR(128) NOT NULL, status VARCHAR(16) NOT NULL,
+    config_json JSON, started_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL, finished_at DATETIME
+);
+CREATE TABLE clean_danmu (
+    id INTEGER NOT NULL PRIMARY KEY, raw_id INTEGER NOT NULL REFERENCES raw_danmu (id), platform VARCHAR(32) NOT NULL,
+    video_id VARCHAR(128) NOT NULL, content_norm TEXT NOT NULL, tokens_json JSON, sentiment_label VARCHAR(16),
+    sentiment_score FLOAT, danmu_type VARCHAR(32), cleaned_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    pipeline_run_id INTEGER NOT NULL REFERENCES pipeline_run (id)
+);
+CREATE INDEX ix_clean_danmu_platform_video_ts ON clean_danmu (platform, video_id)
+"""
+
+
+def _check_legacy_schema_upgrade() -> None:
+    legacy_rows = [
+        (1, "第一条", 1.25, sha256_hex("bilibili:u1"), {"cid": 5, "segment_index": 1, "mode": 1, "duration": 120.0}),
+        (2, "第二条", 2.5, None, {"mode": 4, "color": 16777215, "page": None}),
+    ]
+    with tempfile.TemporaryDirectory() as root:
+        engine = create_engine(f"sqlite:///{root}/legacy.db")
+        with engine.begin() as conn:
+            for ddl in _LEGACY_SCHEMA.split(";"):
+                conn.exec_driver_sql(ddl)
+            for raw_id, content, video_ts, uid, payload in legacy_rows:
+                conn.exec_driver_sql(
+                    "INSERT INTO raw_danmu (id, platform, video_id, content, video_ts, user_id_hash, dedup_hash, raw_json) "
+                    "VALUES (?, 'bilibili', 'BV_LEGACY', ?, ?, ?, ?, ?)",
+                    (raw_id, content, video_ts, uid, f"legacy{raw_id}", json.dumps(payload, ensure_ascii=False)),
+                )
+            conn.exec_driver_sql(
+                "INSERT INTO pipeline_run (id, platform, video_id, status) VALUES (1, 'bilibili', 'BV_LEGACY', 'SUCCEEDED')"
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO clean_danmu (raw_id, platform, video_id, content_norm, pipeline_run_id) "
+                "SELECT id, platform, video_id, content, 1 FROM raw_danmu"
+            )
+            for _ in range(2):
+                conn.exec_driver_sql(
+                    "INSERT INTO crawl_task (platform, video_id, task_type, status, retry_count) "
+                    "VALUES ('bilibili', 'BV_LEGACY', 'history', 'PENDING', 0)"
+                )
+
+        for _ in range(2):
+            Base.metadata.create_all(engine)
+            upgrade_schema(engine)
+
+        with Session(engine) as db:
+            rows = {row.id: row for row in db.execute(select(RawDanmu)).scalars()}
+            for raw_id, content, video_ts, uid, payload in legacy_rows:
+                row = rows[raw_id]
+                expected_key = dedup_key("bilibili", "BV_LEGACY", content, video_ts, uid, payload.get("cid"))
+                assert row.dedup_key == expected_key, f"raw {raw_id}: dedup_key not migrated"
+                assert row.raw_json is None and row.payload == {**payload, "content": content}, f"raw {raw_id}: payload changed"
+            assert (rows[1].cid, rows[1].mode, rows[2].color) == (5, 1, 16777215), "typed columns not filled"
+            clean = db.execute(
+                select(CleanDanmu.raw_id, CleanDanmu.video_ts, CleanDanmu.user_id_hash).order_by(CleanDanmu.raw_id)
+            ).all()
+            assert [tuple(r) for r in clean] == [(r[0], r[2], r[3]) for r in legacy_rows], "clean_danmu not denormalized"
+            active = db.execute(select(func.count()).select_from(CrawlTask).where(CrawlTask.status == "PENDING")).scalar_one()
+            assert active == 1, "duplicate active crawl tasks should be closed"
+        indexes = {index["name"] for index in inspect(engine).get_indexes("clean_danmu")}
+        assert "ix_clean_danmu_platform_video_ts" not in indexes, "obsolete index not dropped"
+        assert "uq_crawl_task_active" in {index["name"] for index in inspect(engine).get_indexes("crawl_task")}
+        engine.dispose()
+
+
+def _check_live_proto_round_trip() -> None:
+    danmu = {"cmd": "DANMU_MSG", "info": [[0, 1, 25, 16777215, 1700000000123, 0, 0, "ab12cd34"], "前方高能", [42, "u"], 0, [12]]}
+    gift = {"cmd": "SEND_GIFT", "data": {}}
+    inner = pack_json(OP_MESSAGE, danmu) + pack_json(OP_MESSAGE, gift)
+    stream = (
+        pack_json(OP_AUTH_REPLY, {"code": 0})
+        + pack_packet(OP_HEARTBEAT_REPLY, (1234).to_bytes(4, "big"))
+        + pack_packet(OP_MESSAGE, b"{not json")
+        + pack_packet(OP_MESSAGE, zlib.compress(inner), protover=PROTOVER_ZLIB)
+        + pack_json(OP_MESSAGE, danmu)[:10]
+    )
+    packets = list(unpack_packets(stream))
+    assert packets == [(OP_AUTH_REPLY, {"code": 0}), (OP_HEARTBEAT_REPLY, 1234), (OP_MESSAGE, danmu), (OP_MESSAGE, gift)], packets
+
+    adapter = BilibiliAdapter()
+    event = adapter._live_event("live:1", 1, danmu, 3.5)
+    assert event is not None and (event.content, event.video_ts, event.user_id, event.user_level) == ("前方高能", 3.5, "42", 12)
+    assert event.send_time == datetime.fromtimestamp(1700000000.123, tz=timezone.utc)
+    assert adapter._live_event("live:1", 1, gift, 3.5) is None, "non-danmu commands should be dropped"
+
+
+async def _fetch_time_series(platform: str, video_id: str, metric_name: str) -> list[dict]:
+    try:
+        async with get_async_session_factory()() as adb:
+            return await get_time_series(platform=platform, video_id=video_id, metric_name=metric_name, bucket_sec=10, db=adb)
+    finally:
+        await dispose_async_engine()
+
+
 def _seed_raw_danmu(db, platform: str, video_id: str) -> None:
     rows = [
         (0.2, "开场@up 主好", 1),
@@ -58,7 +375,6 @@ def _seed_raw_danmu(db, platform: str, video_id: str) -> None:
         (80.0, "爷青回", 1),
     ]
     for i, (ts, content, mode) in enumerate(rows, start=1):
-        d_hash = sha256_hex(f"{platform}|{video_id}|{i}")
         db.add(
             RawDanmu(
                 platform=platform,
@@ -69,7 +385,7 @@ def _seed_raw_danmu(db, platform: str, video_id: str) -> None:
                 user_id_hash=sha256_hex(f"{platform}:user{i%3}"),
                 user_level=None,
                 like_count=None,
-                dedup_hash=d_hash,
+                dedup_key=i,
                 raw_json={"mode": mode, "segment_index": 1, "cid": 1, "duration": 120.0},
             )
         )
@@ -3,28 +3,39 @@ from __future__ import annotations
 import asyncio
 import contextlib
 import logging
-from datetime import timezone
+import time
+from datetime import datetime, timezone
 from typing import Any
 
 from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
 from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from analytics.runner import run_analysis
 from cache.file_backend import FileCacheBackend
 from config.logging import configure_logging
 from config.settings import settings
+from crawlers.http_pool import http_pool
+from crawlers.notifier import task_notifier
 from crawlers.platforms.registry import create_adapter
+from crawlers.rate_limit import rate_limiters
 from crawlers.scheduler import run_forever
 from data_pipeline.loader.pipeline_runner import run_pipeline
+from database.compactor import RetentionPolicy, compactor_loop
 from database.init_db import init_db
-from database.models import MetricsSummary, MetricsTimeSeries, PipelineRun
+from database.models import CrawlTask, MetricsSummary, MetricsTimeSeries, PipelineRun
 from database.repositories.crawl_task_repo import CrawlTaskRepository
 from database.repositories.video_repo import VideoRepository
-from database.session import get_db
+from database.session import dispose_async_engine, engine, get_async_db, get_async_read_db, get_read_db
+from database.sharding import shard_router, shard_session
+from database.sqlite_profile import sqlite_maintenance_loop
+from monitoring import metrics
 from visualization.report.html_report import generate_html_report
 
 
@@ -35,6 +46,9 @@ class CreateCrawlTaskRequest(BaseModel):
     platform: str = Field(default="bilibili")
     video_input: str
     task_type: str = Field(default="history")
+    priority: int = Field(default=0)
+    deadline_at: datetime | None = None
+    submitter: str | None = Field(default=None, max_length=64)
 
 
 class CreateCrawlTaskResponse(BaseModel):
@@ -42,6 +56,30 @@ class CreateCrawlTaskResponse(BaseModel):
     platform: str
     video_id: str
     status: str
+    reused: bool = False
+
+
+class CreateCrawlTaskBatchRequest(BaseModel):
+    platform: str = Field(default="bilibili")
+    video_inputs: list[str] = Field(min_length=1, max_length=settings.crawl_batch_max_inputs)
+    task_type: str = Field(default="history")
+    priority: int = Field(default=0)
+    deadline_at: datetime | None = None
+    submitter: str | None = Field(default=None, max_length=64)
+
+
+class CrawlTaskBatchItem(BaseModel):
+    video_input: str
+    task_id: int
+    video_id: str
+    status: str
+    reused: bool
+
+
+class CreateCrawlTaskBatchResponse(BaseModel):
+    created: int
+    reused: int
+    items: list[CrawlTaskBatchItem]
 
 
 class RunAnalyticsRequest(BaseModel):
@@ -62,20 +100,57 @@ templates = Jinja2Templates(directory="visualization/dashboard/templates")
 cache_backend = FileCacheBackend(settings.cache_dir)
 
 
+if settings.metrics_enabled:
+
+    @app.middleware("http")
+    async def _record_request_latency(request: Request, call_next: Any) -> Response:
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            metrics.http_request_seconds.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+
+
 @app.on_event("startup")
 async def _startup() -> None:
     configure_logging(settings.log_level)
     init_db()
     app.state.poller_task = asyncio.create_task(run_forever())
+    if settings.sqlite_maintenance_interval_sec > 0:
+        app.state.sqlite_maintenance_task = asyncio.create_task(
+            sqlite_maintenance_loop(_maintained_engines, settings.sqlite_maintenance_interval_sec)
+        )
+    if settings.retention_interval_sec > 0:
+        app.state.compactor_task = asyncio.create_task(
+            compactor_loop(RetentionPolicy.from_settings(settings), settings.retention_interval_sec)
+        )
+
+
+def _maintained_engines() -> list[Engine]:
+    return [engine, *(shard_router.engines() if shard_router is not None else [])]
 
 
 @app.on_event("shutdown")
 async def _shutdown() -> None:
-    task: asyncio.Task | None = getattr(app.state, "poller_task", None)
-    if task is not None:
-        task.cancel()
-        with contextlib.suppress(BaseException):
-            await task
+    for name in ("poller_task", "sqlite_maintenance_task", "compactor_task"):
+        task: asyncio.Task | None = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(BaseException):
+                await task
+    await http_pool.close()
+    await dispose_async_engine()
+    if shard_router is not None:
+        shard_router.dispose()
 
 
 @app.get("/health")
@@ -89,18 +164,75 @@ def dashboard(request: Request) -> HTMLResponse:
 
 
 @app.post("/tasks/crawl", response_model=CreateCrawlTaskResponse)
-async def create_crawl_task(req: CreateCrawlTaskRequest, db: Session = Depends(get_db)) -> CreateCrawlTaskResponse:
+async def create_crawl_task(req: CreateCrawlTaskRequest, db: AsyncSession = Depends(get_async_db)) -> CreateCrawlTaskResponse:
     adapter = create_adapter(req.platform)
     canonical_video_id = await adapter.resolve_video(req.video_input)
-    VideoRepository(db).get_or_create(platform=req.platform, video_id=canonical_video_id)
-    task = CrawlTaskRepository(db).create(platform=req.platform, video_id=canonical_video_id, task_type=req.task_type)
-    db.commit()
-    return CreateCrawlTaskResponse(task_id=task.id, platform=task.platform, video_id=task.video_id, status=task.status)
+
+    def create(sync_db: Session) -> tuple[CrawlTask, bool]:
+        VideoRepository(sync_db).get_or_create(platform=req.platform, video_id=canonical_video_id)
+        tasks = CrawlTaskRepository(sync_db).create_or_reuse_many(
+            req.platform,
+            [canonical_video_id],
+            req.task_type,
+            priority=req.priority,
+            deadline_at=req.deadline_at,
+            submitter=req.submitter,
+        )
+        return tasks[canonical_video_id]
+
+    task, reused = await db.run_sync(create)
+    await db.commit()
+    if not reused:
+        await task_notifier.notify()
+    return CreateCrawlTaskResponse(
+        task_id=task.id, platform=task.platform, video_id=task.video_id, status=task.status, reused=reused
+    )
+
+
+@app.post("/tasks/crawl/batch", response_model=CreateCrawlTaskBatchResponse)
+async def create_crawl_tasks_batch(
+    req: CreateCrawlTaskBatchRequest, db: AsyncSession = Depends(get_async_db)
+) -> CreateCrawlTaskBatchResponse:
+    adapter = create_adapter(req.platform)
+    canonical_ids = await asyncio.gather(*(adapter.resolve_video(video_input) for video_input in req.video_inputs))
+    unique_ids = list(dict.fromkeys(canonical_ids))
+
+    def create(sync_db: Session) -> dict[str, tuple[CrawlTask, bool]]:
+        VideoRepository(sync_db).ensure_many(req.platform, unique_ids)
+        return CrawlTaskRepository(sync_db).create_or_reuse_many(
+            req.platform,
+            unique_ids,
+            req.task_type,
+            priority=req.priority,
+            deadline_at=req.deadline_at,
+            submitter=req.submitter,
+        )
+
+    tasks = await db.run_sync(create)
+    await db.commit()
+    if not all(reused for _, reused in tasks.values()):
+        await task_notifier.notify()
+    items = []
+    for video_input, video_id in zip(req.video_inputs, canonical_ids):
+        task, reused = tasks[video_id]
+        items.append(CrawlTaskBatchItem(video_input=video_input, task_id=task.id, video_id=video_id, status=task.status, reused=reused))
+    created = sum(1 for _, reused in tasks.values() if not reused)
+    return CreateCrawlTaskBatchResponse(created=created, reused=len(tasks) - created, items=items)
+
+
+@app.get("/tasks/queue/stats")
+async def get_queue_stats(db: AsyncSession = Depends(get_async_read_db)) -> dict[str, Any]:
+    priorities = await db.run_sync(lambda sync_db: CrawlTaskRepository(sync_db).queue_stats())
+    return {
+        "priorities": priorities,
+        "pending": sum(row["pending"] for row in priorities),
+        "running": sum(row["running"] for row in priorities),
+    }
 
 
 @app.get("/tasks/{task_id}")
-def get_task(task_id: int, db: Session = Depends(get_db)) -> dict[str, Any]:
-    task = CrawlTaskRepository(db).get(task_id)
+async def get_task(task_id: int, db: AsyncSession = Depends(get_async_read_db)) -> dict[str, Any]:
+    task = await db.run_sync(lambda sync_db: CrawlTaskRepository(sync_db).get(task_id))
     if task is None:
         raise HTTPException(status_code=404, detail="task not found")
     return {
@@ -109,6 +241,10 @@ def get_task(task_id: int, db: Session = Depends(get_db)) -> dict[str, Any]:
         "video_id": task.video_id,
         "task_type": task.task_type,
         "status": task.status,
+        "priority": task.priority,
+        "deadline_at": task.deadline_at,
+        "submitter": task.submitter,
+        "started_at": task.started_at,
         "cursor_json": task.cursor_json,
         "retry_count": task.retry_count,
         "last_error": task.last_error,
@@ -118,31 +254,40 @@ def get_task(task_id: int, db: Session = Depends(get_db)) -> dict[str, Any]:
 
 
 @app.post("/tasks/{task_id}/retry")
-def retry_task(task_id: int, db: Session = Depends(get_db)) -> dict[str, Any]:
-    repo = CrawlTaskRepository(db)
-    task = repo.get(task_id)
-    if task is None:
+async def retry_task(task_id: int, db: AsyncSession = Depends(get_async_db)) -> dict[str, Any]:
+    def retry(sync_db: Session) -> bool:
+        repo = CrawlTaskRepository(sync_db)
+        if repo.get(task_id) is None:
+            return False
+        try:
+            repo.update_status(task_id, status="PENDING", last_error=None)
+        except IntegrityError as e:
+            raise HTTPException(status_code=409, detail="another active task exists for this video") from e
+        return True
+
+    if not await db.run_sync(retry):
         raise HTTPException(status_code=404, detail="task not found")
-    repo.update_status(task_id, status="PENDING", last_error=None)
-    db.commit()
+    await db.commit()
+    await task_notifier.notify()
     return {"id": task_id, "status": "PENDING"}
 
 
 @app.post("/analytics/run", response_model=RunAnalyticsResponse)
-def run_pipeline_and_analysis(req: RunAnalyticsRequest, db: Session = Depends(get_db)) -> RunAnalyticsResponse:
-    run = run_pipeline(db, platform=req.platform, video_id=req.video_id, config_json=None)
-    run_analysis(db, platform=req.platform, video_id=req.video_id, pipeline_run_id=run.id)
+def run_pipeline_and_analysis(req: RunAnalyticsRequest) -> RunAnalyticsResponse:
+    with shard_session(req.platform, req.video_id) as db:
+        run = run_pipeline(db, platform=req.platform, video_id=req.video_id, config_json=None)
+        run_analysis(db, platform=req.platform, video_id=req.video_id, pipeline_run_id=run.id)
     cache_backend.cleanup()
     return RunAnalyticsResponse(pipeline_run_id=run.id)
 
 
 @app.get("/analytics/time_series")
-def get_time_series(
+async def get_time_series(
     platform: str,
     video_id: str,
     metric_name: str,
     bucket_sec: int = 10,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
 ) -> list[dict[str, Any]]:
     stmt = (
         select(MetricsTimeSeries)
@@ -154,7 +299,7 @@ def get_time_series(
         )
         .order_by(MetricsTimeSeries.bucket_start.asc())
     )
-    rows = db.execute(stmt).scalars().all()
+    rows = (await db.execute(stmt)).scalars().all()
     result: list[dict[str, Any]] = []
     for r in rows:
         bucket_start = r.bucket_start
@@ -172,33 +317,45 @@ def get_time_series(
 
 
 @app.get("/analytics/summary")
-def get_summary(platform: str, video_id: str, metric_name: str, db: Session = Depends(get_db)) -> dict[str, Any]:
+async def get_summary(
+    platform: str, video_id: str, metric_name: str, db: AsyncSession = Depends(get_async_read_db)
+) -> dict[str, Any]:
     stmt = (
         select(MetricsSummary)
         .where(MetricsSummary.platform == platform, MetricsSummary.video_id == video_id, MetricsSummary.metric_name == metric_name)
         .order_by(MetricsSummary.pipeline_run_id.desc())
         .limit(1)
     )
-    row = db.execute(stmt).scalars().first()
+    row = (await db.execute(stmt)).scalars().first()
     if row is None:
         raise HTTPException(status_code=404, detail="summary not found")
     return {"metric_name": row.metric_name, "value": row.value_json, "pipeline_run_id": row.pipeline_run_id}
 
 
 @app.get("/pipeline/latest")
-def get_latest_pipeline(platform: str, video_id: str, db: Session = Depends(get_db)) -> dict[str, Any]:
+async def get_latest_pipeline(platform: str, video_id: str, db: AsyncSession = Depends(get_async_read_db)) -> dict[str, Any]:
     stmt = (
         select(PipelineRun)
         .where(PipelineRun.platform == platform, PipelineRun.video_id == video_id)
         .order_by(PipelineRun.id.desc())
         .limit(1)
     )
-    run = db.execute(stmt).scalars().first()
+    run = (await db.execute(stmt)).scalars().first()
     if run is None:
         raise HTTPException(status_code=404, detail="pipeline_run not found")
     return {"pipeline_run_id": run.id, "status": run.status, "started_at": run.started_at, "finished_at": run.finished_at}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/crawler/rate_limits")
+def get_rate_limits() -> dict[str, Any]:
+    return {"hosts": rate_limiters.snapshot()}
+
+
 @app.post("/cache/cleanup")
 def cleanup_cache() -> dict[str, str]:
     cache_backend.cleanup()
@@ -206,7 +363,7 @@ def cleanup_cache() -> dict[str, str]:
 
 
 @app.post("/report/html", response_model=GenerateReportResponse)
-def generate_report(req: RunAnalyticsRequest, db: Session = Depends(get_db)) -> GenerateReportResponse:
+def generate_report(req: RunAnalyticsRequest, db: Session = Depends(get_read_db)) -> GenerateReportResponse:
     out_dir = settings.data_dir / "reports"
     output_path = out_dir / f"{req.platform}_{req.video_id}.html"
     path = generate_html_report(db, platform=req.platform, video_id=req.video_id, output_path=output_path)